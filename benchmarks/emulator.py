@@ -0,0 +1,351 @@
+"""Emulator of the RS-232C control protocol of a Sharp Aquos TV.
+
+The emulator listens on a pseudo terminal, so TV and AsyncTV can open it
+like a serial port:
+
+    emulator = AquosEmulator(baudrate=9600)
+    tv = TV(emulator.start())
+    ...
+    emulator.stop()
+
+Commands are 8 characters, the 4 character command followed by its
+parameter and padded with spaces, terminated by "\\r". Every command is
+answered with "OK", "ERR" or the requested value, terminated by "\\r".
+
+start_tcp() serves the IP control protocol instead, for IpTV and AsyncIpTV,
+with the "Login:" and "Password:" prompts when a username is given:
+
+    emulator = AquosEmulator()
+    tv = IpTV(*emulator.start_tcp(username='admin', password='secret'),
+              username='admin', password='secret')
+
+Run as a script to serve a pty, or a TCP port with --tcp, until interrupted:
+
+    python benchmarks/emulator.py [--baud 9600] [--tcp 10002]
+"""
+import argparse
+from functools import partial
+import os
+import random
+import select
+import socket
+import threading
+import time
+import tty
+
+# Inputs of the us command map: IAVD index 0 is the tuner (ITVD)
+INPUTS = range(0, 9)
+
+INFO = {
+    'TVNM': 'AQUOS EMULATOR',
+    'MNRD': 'LC-00EMU',
+    'SWVN': '1.00',
+    'IPPV': '1',
+}
+
+# Settings that are stored and reported back, with their default value
+SETTINGS = {
+    'AVMD': 1,
+    'WIDE': 10,
+    'ACSU': 1,
+    'DCCH': 1,
+    'DA2P': 101,
+    'DC2U': 1,
+    'DC2L': 0,
+}
+
+
+class AquosEmulator(object):
+    """
+    Emulated TV state and protocol.
+
+    byte_delay: seconds to wait per byte sent or received,
+        on top of the time the baud rate needs
+    baudrate: emulate the transfer time of a 8N1 line at this rate,
+        None to answer as fast as possible
+    reply_delay: seconds the TV takes to process a command
+    drop_rate: probability that a command is not answered
+    error_rate: probability that a valid command is answered with ERR
+    garbage_rate: probability that a reply is replaced by garbage
+    seed: seed for the fault injection
+    boot_time: seconds the TV does not answer after being switched on
+    """
+
+    def __init__(self, byte_delay=0.0, baudrate=None, reply_delay=0.0,
+                 drop_rate=0.0, error_rate=0.0, garbage_rate=0.0, seed=None,
+                 boot_time=0.0):
+        self.byte_delay = byte_delay
+        self.baudrate = baudrate
+        self.reply_delay = reply_delay
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.garbage_rate = garbage_rate
+        self.boot_time = boot_time
+        self._booted_at = 0
+        self.power = 1
+        self.power_control = 0
+        self.volume = 20
+        self.mute = 2
+        self.input = 1
+        self.settings = dict(SETTINGS)
+        self._sleep_until = None
+        self.received = []
+        self._random = random.Random(seed)
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._wakeup = None
+        self._server = None
+        self._sessions = []
+        self._session_threads = []
+        self.logins = 0
+
+    def start(self):
+        """Start serving on a new pty and return the device path."""
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self._wakeup = os.pipe()
+        self._thread = threading.Thread(
+            target=self._serve, args=(partial(self._read_pty, self._master, self._wakeup[0]),
+                                      partial(os.write, self._master)),
+            daemon=True)
+        self._thread.start()
+        return os.ttyname(self._slave)
+
+    def start_tcp(self, host='127.0.0.1', port=0, username=None, password=None,
+                  idle_timeout=None):
+        """
+        Start serving the IP control protocol, return the (host, port) listened on.
+
+        username: prompt for username and password, close the session
+            when they do not match
+        idle_timeout: seconds after which an idle session is closed
+        """
+        self._server = socket.create_server((host, port))
+        self._thread = threading.Thread(
+            target=self._accept, args=(username, password, idle_timeout), daemon=True)
+        self._thread.start()
+        return self._server.getsockname()[:2]
+
+    @staticmethod
+    def _read_pty(master, wakeup, size):
+        # stop() writes to wakeup, the thread ends before the fds are closed
+        ready = select.select([master, wakeup], [], [])[0]
+        if wakeup in ready:
+            return b''
+        return os.read(master, size)
+
+    def stop(self):
+        """Stop serving and close the pty or the TCP port."""
+        # Wake the threads and wait for them before closing anything,
+        # a closed fd number may be reused by the next openpty()
+        if self._wakeup is not None:
+            os.write(self._wakeup[1], b'x')
+        if self._server is not None:
+            self._server.shutdown(socket.SHUT_RDWR)
+        for session in list(self._sessions):
+            try:
+                session.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for thread in [self._thread] + self._session_threads:
+            if thread is not None:
+                thread.join()
+        self._thread = None
+        self._session_threads = []
+        for fd in (self._slave, self._master) + (self._wakeup or ()):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = self._wakeup = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        self._sessions = []
+
+    def close_sessions(self):
+        """Close all TCP sessions, as a TV does after they were idle."""
+        for session in self._sessions:
+            session.shutdown(socket.SHUT_RDWR)
+
+    def _accept(self, username, password, idle_timeout):
+        server = self._server
+        while True:
+            try:
+                session, _ = server.accept()
+            except OSError:
+                return
+            self._sessions.append(session)
+            thread = threading.Thread(target=self._serve_session,
+                                      args=(session, username, password, idle_timeout),
+                                      daemon=True)
+            self._session_threads.append(thread)
+            thread.start()
+
+    def _serve_session(self, session, username, password, idle_timeout):
+        session.settimeout(idle_timeout)
+        try:
+            buffer = b''
+            if username is not None:
+                session.sendall(b'Login:')
+                given, buffer = self._read_line(session, buffer)
+                session.sendall(b'\r\nPassword:')
+                secret, buffer = self._read_line(session, buffer)
+                if (given, secret) != (username, password):
+                    return
+                session.sendall(b'\r\n')
+            self.logins += 1
+            self._serve(session.recv, session.sendall, buffer)
+        except OSError:
+            pass
+        finally:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            session.close()
+
+    @staticmethod
+    def _read_line(session, buffer):
+        while b'\r' not in buffer:
+            data = session.recv(1024)
+            if not data:
+                raise ConnectionResetError('Connection closed during login')
+            buffer += data
+        line, _, buffer = buffer.partition(b'\r')
+        return line.strip().decode('utf-8', 'replace'), buffer
+
+    def _transfer_time(self, count):
+        delay = self.byte_delay * count
+        if self.baudrate:
+            # start bit, 8 data bits and a stop bit per byte
+            delay += count * 10 / self.baudrate
+        return delay
+
+    def _serve(self, read, write, buffer=b''):
+        while True:
+            while b'\r' in buffer:
+                frame, _, buffer = buffer.partition(b'\r')
+                # Clients terminate with "\r\n", the "\n" starts the next frame
+                frame = frame.lstrip(b'\n')
+                if not frame.strip():
+                    continue
+                time.sleep(self._transfer_time(len(frame) + 1) + self.reply_delay)
+                reply = self.handle(frame)
+                if reply is None:
+                    continue
+                time.sleep(self._transfer_time(len(reply)))
+                try:
+                    write(reply)
+                except OSError:
+                    return
+            try:
+                data = read(1024)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+
+    def handle(self, frame):
+        """Return the reply to one command frame, or None to stay silent."""
+        command = frame.decode('ascii', 'replace')
+        self.received.append(command)
+        if time.monotonic() < self._booted_at:
+            return None
+        if self._random.random() < self.drop_rate:
+            return None
+        if self._random.random() < self.garbage_rate:
+            return bytes(self._random.randrange(32, 127) for _ in range(3)) + b'\r'
+        reply = self._reply(command[:4], command[4:].strip())
+        if reply != 'ERR' and self._random.random() < self.error_rate:
+            reply = 'ERR'
+        return reply.encode('ascii') + b'\r'
+
+    def _reply(self, name, param):
+        if name == 'POWR':
+            was_on = self.power
+            reply = self._setting('power', param, (0, 1))
+            if self.power and not was_on:
+                self._booted_at = time.monotonic() + self.boot_time
+            return reply
+        if name == 'RSPW':
+            return self._setting('power_control', param, (0, 1, 2))
+        if not self.power:
+            return 'ERR'
+        if name in INFO:
+            return INFO[name] if param == '1' else 'ERR'
+        if name == 'VOLM':
+            return self._setting('volume', param, range(0, 101))
+        if name == 'MUTE':
+            if param == '0':
+                self.mute = 1 if self.mute == 2 else 2
+                return 'OK'
+            return self._setting('mute', param, (1, 2))
+        if name == 'IAVD':
+            return self._setting('input', param, INPUTS)
+        if name == 'ITVD':
+            self.input = 0
+            return 'OK'
+        if name in ('RCKY', 'CHUP', 'CHDW'):
+            return 'OK'
+        if name == 'OFTM':
+            return self._sleep_timer(param)
+        if name in self.settings:
+            if param == '?':
+                return str(self.settings[name])
+            if param.isdigit():
+                self.settings[name] = int(param)
+                return 'OK'
+        return 'ERR'
+
+    def _sleep_timer(self, param):
+        # Set in steps of 30 minutes, reported as minutes left
+        if param == '?':
+            if self._sleep_until is None:
+                return '0'
+            return str(max(0, int((self._sleep_until - time.monotonic()) // 60)))
+        if param.isdigit() and int(param) in range(0, 5):
+            self._sleep_until = (time.monotonic() + int(param) * 30 * 60
+                                 if int(param) else None)
+            return 'OK'
+        return 'ERR'
+
+    def _setting(self, attribute, param, valid):
+        if param == '?':
+            return str(getattr(self, attribute))
+        if param.isdigit() and int(param) in valid:
+            setattr(self, attribute, int(param))
+            return 'OK'
+        return 'ERR'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve an emulated Aquos TV on a pty')
+    parser.add_argument('--baud', type=int, default=None)
+    parser.add_argument('--byte-delay', type=float, default=0.0)
+    parser.add_argument('--reply-delay', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--boot-time', type=float, default=0.0)
+    parser.add_argument('--tcp', type=int, default=None, metavar='PORT',
+                        help='serve the IP control protocol on this port instead of a pty')
+    parser.add_argument('--username', default=None)
+    parser.add_argument('--password', default='')
+    parser.add_argument('--idle-timeout', type=float, default=None)
+    args = parser.parse_args()
+    emulator = AquosEmulator(byte_delay=args.byte_delay, baudrate=args.baud,
+                             reply_delay=args.reply_delay, drop_rate=args.drop_rate,
+                             error_rate=args.error_rate, boot_time=args.boot_time)
+    if args.tcp is None:
+        print(emulator.start(), flush=True)
+    else:
+        print('%s:%s' % emulator.start_tcp('0.0.0.0', args.tcp, args.username,
+                                           args.password, args.idle_timeout), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Measure command round trips against the emulated TV.
+
+    python benchmarks/roundtrip.py [--samples N] [--baud 9600]
+
+Reports latency of TV._send_command_raw(), the wall time of one status
+poll with TV and AsyncTV, and commands per second. When Home Assistant
+is installed, SharpAquosTVDevice.async_update() is measured as well.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'custom_components'))
+
+from emulator import AquosEmulator  # noqa: E402
+from aquostv_serial.aio import AsyncTV  # noqa: E402
+from aquostv_serial.tv import TV  # noqa: E402
+
+
+def report(name, times, commands=1):
+    times_ms = sorted(elapsed * 1000 for elapsed in times)
+    p95 = times_ms[min(len(times_ms) - 1, int(len(times_ms) * 0.95))]
+    rate = commands * len(times) / sum(times)
+    print('{:32} median {:8.2f} ms  p95 {:8.2f} ms  {:8.1f} commands/s'.format(
+        name, statistics.median(times_ms), p95, rate))
+
+
+def measure(func, samples):
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+async def measure_async(func, samples):
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        await func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# Fields of the sequential poll, status() queries them in one exchange
+POLL_FIELDS = ('power', 'mute', 'input', 'volume')
+
+
+def bench_sync(port, samples):
+    tv = TV(port)
+    report('TV._send_command_raw', measure(lambda: tv._send_command_raw('POWR', '?'), samples))
+
+    def sequential():
+        tv.power()
+        tv.mute()
+        tv.input()
+        tv.volume()
+    report('TV sequential poll', measure(sequential, samples), len(POLL_FIELDS))
+    report('TV.status', measure(lambda: tv.status(POLL_FIELDS), samples), len(POLL_FIELDS))
+    tv._connection.close()
+
+
+async def bench_async(port, samples):
+    tv = AsyncTV(port)
+    report('AsyncTV._send_command_raw',
+           await measure_async(lambda: tv._send_command_raw('POWR', '?'), samples))
+    report('AsyncTV.status', await measure_async(lambda: tv.status(POLL_FIELDS), samples),
+           len(POLL_FIELDS))
+    try:
+        from aquostv_serial.media_player import SharpAquosTVDevice
+    except (ImportError, SyntaxError):
+        # media_player needs Home Assistant and the Python version it runs on
+        print('SharpAquosTVDevice.async_update  skipped, Home Assistant is not available')
+    else:
+        entity = SharpAquosTVDevice('bench', tv)
+        report('SharpAquosTVDevice.async_update',
+               await measure_async(entity.async_update, samples), 4)
+    await tv.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--baud', type=int, default=9600)
+    parser.add_argument('--byte-delay', type=float, default=0.0)
+    parser.add_argument('--reply-delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    emulator = AquosEmulator(baudrate=args.baud, byte_delay=args.byte_delay,
+                             reply_delay=args.reply_delay)
+    port = emulator.start()
+    try:
+        bench_sync(port, args.samples)
+        asyncio.run(bench_async(port, args.samples))
+    finally:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
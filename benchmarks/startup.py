@@ -0,0 +1,56 @@
+"""Measure import plus TV() construction time of the integration.
+
+Each sample runs in a fresh interpreter, so module imports and the
+command map are loaded from scratch every time.
+
+    python benchmarks/startup.py [--samples N] [--map us]
+
+"cold" removes the command map cache first, so the yaml file is parsed
+with PyYAML as on the first start. "warm" loads the cached map.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(ROOT, 'custom_components', 'aquostv_serial', 'commands', '__pycache__')
+
+SAMPLE = """
+import sys, time
+sys.path.insert(0, {path!r})
+start = time.perf_counter()
+from aquostv_serial.tv import TV
+TV('loop://', command_map={command_map!r})
+print(time.perf_counter() - start, 'yaml' in sys.modules)
+"""
+
+
+def sample(command_map, cold):
+    if cold:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    code = SAMPLE.format(path=os.path.join(ROOT, 'custom_components'), command_map=command_map)
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True).stdout.split()
+    return float(output[0]), output[1] == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--map', default='us')
+    args = parser.parse_args()
+
+    for name, cold in (('cold', True), ('warm', False)):
+        # Let the warm run start from a fresh cache
+        sample(args.map, cold)
+        results = [sample(args.map, cold) for _ in range(args.samples)]
+        times = [elapsed * 1000 for elapsed, _ in results]
+        print('{:5} median {:7.2f} ms  min {:7.2f} ms  yaml imported: {}'.format(
+            name, statistics.median(times), min(times), any(yaml for _, yaml in results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,631 @@
+"""Asyncio client for a Sharp Aquos Remote Control enabled TV."""
+import asyncio
+import collections
+from functools import partial
+import itertools
+import logging
+import socket
+import time
+
+from .connection import IP_PORT, FrameBuffer, LoginError, LoginHandshake
+from .replies import UnexpectedReplyError
+from .retry import CircuitBreaker, ReopenBackoff, RetryPolicy, UnavailableError, WarmUp
+from .stats import CommandStats
+from .tv import EIGHTBITS, PARITY_NONE, STOPBITS_ONE, TV, Status
+
+_LOGGER = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_USER = 0
+PRIORITY_POLL = 1
+
+
+class _AquosProtocol(asyncio.Protocol):
+    """
+    Description:
+
+        asyncio protocol splitting the serial or TCP stream into
+        "\\r" terminated replies and handing them to waiting requests
+        in the order the requests were written
+
+        A request that timed out keeps its place, so its late reply
+        is dropped instead of handed to the next request,
+        see discard_input().
+
+        login: LoginHandshake answering the prompts
+            received before the first reply, or None
+    """
+
+    def __init__(self, login=None):
+        self.transport = None
+        self._frames = FrameBuffer()
+        self._waiters = collections.deque()
+        self._login = login
+        self._logged_in = None
+        self._input = asyncio.Event()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self._login is not None:
+            self._logged_in = asyncio.get_running_loop().create_future()
+
+    def data_received(self, data):
+        if self._login is not None:
+            answer = self._login.feed(data)
+            if answer:
+                self.transport.write(answer)
+            if not self._login.done:
+                return
+            data = self._login.rest()
+            if not data:
+                # Wait for the reply to the password, see TcpConnection
+                return
+            self._login = None
+            self._logged_in.set_result(None)
+        self._input.set()
+        self._frames.feed(data)
+        while True:
+            frame = self._frames.pop()
+            if frame is None:
+                break
+            if not self._waiters:
+                _LOGGER.debug('Dropping unsolicited reply "%s"', frame)
+                continue
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                _LOGGER.debug('Dropping late reply "%s"', frame)
+            else:
+                waiter.set_result(frame)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if exc is not None:
+            _LOGGER.warning('Connection lost: %s', exc)
+        else:
+            import serial
+            exc = serial.SerialException('Connection closed')
+        if self._logged_in is not None and not self._logged_in.done():
+            if self._login is not None and self._login.done:
+                exc = LoginError('Login failed, wrong username or password')
+            self._logged_in.set_exception(exc)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(exc)
+
+    def expect(self, count=1):
+        """Return futures for the next replies, call discard_input() first."""
+        loop = asyncio.get_running_loop()
+        waiters = [loop.create_future() for _ in range(count)]
+        self._waiters.extend(waiters)
+        return waiters
+
+    def timed_out(self, waiters):
+        """Give up on waiters, their replies may still arrive."""
+        for waiter in waiters:
+            waiter.cancel()
+
+    def skip_reply(self):
+        """Same as SerialConnection.skip_reply()."""
+        waiter = asyncio.get_running_loop().create_future()
+        waiter.cancel()
+        self._waiters.appendleft(waiter)
+
+    async def discard_input(self, timeout, wait=True):
+        """Coroutine version of SerialConnection.discard_input()."""
+        while wait and self._waiters and self._waiters[0].done():
+            self._input.clear()
+            try:
+                await asyncio.wait_for(self._input.wait(), timeout)
+            except asyncio.TimeoutError:
+                _LOGGER.debug('Late replies did not arrive')
+                break
+        # Requests given up on take no more replies
+        self._waiters = collections.deque(
+            waiter for waiter in self._waiters if not waiter.done())
+        self._frames.resync()
+
+    async def logged_in(self, timeout):
+        """Wait until the login prompts were answered, see TcpConnection."""
+        if self._logged_in is None:
+            return
+        try:
+            await asyncio.wait_for(self._logged_in, timeout)
+        except asyncio.TimeoutError:
+            handshake, self._login = self._login, None
+            if handshake.done:
+                # No reply to the password, the session stays open
+                return
+            if handshake.started:
+                import serial
+                raise serial.SerialException('Login failed, no password prompt')
+            _LOGGER.debug('No login prompt, login is disabled')
+
+
+def _ignore_result(future):
+    # Errors of the warm up are seen by the commands sent after it
+    if not future.cancelled():
+        future.exception()
+
+
+class AsyncTV(TV):
+    """
+    Description:
+        asyncio counterpart of TV
+
+        Commands are written through a pyserial-asyncio transport,
+        so no thread is blocked while waiting for the TV to reply.
+        Every command method of TV is available as a coroutine.
+        The port is opened on the first command, or with open().
+        A port that failed is reopened the same way as by SerialConnection.
+
+        A single worker task owns the port and sends queued exchanges
+        one at a time. Commands changing the TV are sent before
+        pending status queries, and identical pending queries
+        are sent only once.
+
+        volume_delay: seconds queue_volume() waits for further changes
+    """
+
+    def __init__(self, url, baudrate=9600, stopbits=STOPBITS_ONE,
+                 bytesize=EIGHTBITS, parity=PARITY_NONE,
+                 timeout=2, write_timeout=2, command_map='us', retries=2,
+                 volume_delay=0.3):
+        """
+        Initialize the client.
+        """
+        self._url = url
+        self._serial_settings = {"baudrate": baudrate,
+                                 "stopbits": stopbits,
+                                 "bytesize": bytesize,
+                                 "parity": parity}
+        self._timeout = timeout
+        self._transport = None
+        self._protocol = None
+        self._queue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._pending_queries = {}
+        self._worker = None
+        self.retry_policy = RetryPolicy(retries)
+        self.circuit_breaker = CircuitBreaker()
+        self.stats = CommandStats()
+        self.warm_up = WarmUp()
+        self.unsupported = frozenset()
+        self.reopen_backoff = ReopenBackoff()
+        self._volume_delay = volume_delay
+        self._volume_target = None
+        self._volume_timer = None
+        self._volume_task = None
+        self._load_command_map(command_map)
+
+    async def open(self):
+        """
+        Description:
+
+            Open the serial port, or connect and log in,
+            if it is not open yet
+
+        """
+        if self._transport is not None and not self._transport.is_closing():
+            return
+        wait = self.reopen_backoff.wait()
+        if wait > 0:
+            import serial
+            raise serial.SerialException('Reopening {} in {:.1f} s'.format(self._url, wait))
+        try:
+            self._transport, self._protocol = await self._connect(asyncio.get_running_loop())
+        except (OSError, ValueError):
+            self.reopen_backoff.record_failure()
+            raise
+        self.reopen_backoff.record_success()
+        # The TV may have been reset while we were away
+        self._settings.clear()
+
+    async def _connect(self, loop):
+        from serial_asyncio_fast import create_serial_connection
+        return await create_serial_connection(
+            loop, _AquosProtocol, self._url, **self._serial_settings)
+
+    async def close(self):
+        """
+        Description:
+
+            Close the serial port or network session
+
+        """
+        if self._volume_timer is not None:
+            self._volume_timer.cancel()
+            self._volume_timer = None
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        while not self._queue.empty():
+            self._queue.get_nowait()[-1].cancel()
+        self._pending_queries.clear()
+        if self._transport is not None:
+            self._transport.close()
+        self._transport = None
+        self._protocol = None
+
+    async def _send_command_raw(self, command, opt=''):
+        """
+        Description:
+
+            Write a command and wait for its reply
+            without blocking the event loop.
+
+        Returns:
+            Same as TV._send_command_raw
+        """
+        return (await self._send_frames([self._encode_command(command, opt)]))[0]
+
+    async def _send_frames(self, frames, priority=PRIORITY_USER, interval=0):
+        """
+        Description:
+
+            Coroutine version of TV._send_frames.
+            The exchange is queued for the worker task.
+        """
+        data = b''.join(frames)
+        future = self._pending_queries.get(data) if priority == PRIORITY_POLL else None
+        if future is None:
+            future = self._submit(partial(self._send_with_retries, frames, interval,
+                                          priority == PRIORITY_POLL),
+                                  priority, data)
+            if priority == PRIORITY_POLL:
+                self._pending_queries[data] = future
+        # Several callers may share the exchange, do not let one cancel it
+        return await asyncio.shield(future)
+
+    def _submit(self, job, priority, data=None):
+        """Queue the coroutine function job for the worker, return a future of its result."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._sequence), time.perf_counter(),
+                                data, job, future))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run_queue())
+        return future
+
+    async def _run_queue(self):
+        while True:
+            _, _, queued, data, job, future = await self._queue.get()
+            self.stats.queue_wait.add(time.perf_counter() - queued)
+            if data is not None and self._pending_queries.get(data) is future:
+                del self._pending_queries[data]
+            try:
+                result = await job()
+            except asyncio.CancelledError:
+                # close() stopped the worker, do not leave the caller waiting
+                future.cancel()
+                raise
+            except Exception as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _send_with_retries(self, frames, interval=0, queries=False):
+        if self.warm_up.active:
+            await self._wait_until_ready()
+        if self.circuit_breaker.is_open:
+            await self._probe()
+        if len(frames) > 1:
+            results = []
+            try:
+                await self._exchange(frames, results, interval)
+            except OSError:
+                # Replies carry no reference to their command,
+                # see TV._send_frames
+                if not queries:
+                    self.circuit_breaker.record_failure()
+                    raise
+                self.stats.retries += 1
+            else:
+                self.circuit_breaker.record_success()
+                return results
+        return [await self._send_frame(frame) for frame in frames]
+
+    async def _send_frame(self, frame):
+        """Coroutine version of TV._send_frame."""
+        attempt = 0
+        while True:
+            results = []
+            try:
+                await self._exchange([frame], results)
+            except OSError:
+                if attempt >= self.retry_policy.retries:
+                    self.circuit_breaker.record_failure()
+                    raise
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+                self.stats.retries += 1
+            else:
+                self.circuit_breaker.record_success()
+                return results[0]
+
+    async def _wait_until_ready(self):
+        """Coroutine version of TV._wait_until_ready."""
+        frame = self._commands.frame('power', '?')
+        while self.warm_up.active:
+            if self.warm_up.expired():
+                _LOGGER.warning('TV did not answer within %s s after power on',
+                                self.warm_up.max_time)
+                break
+            started = time.monotonic()
+            reply = None
+            try:
+                await self.open()
+                # Late replies to earlier probes answer the same query
+                await self._protocol.discard_input(self._timeout, wait=False)
+                reply = self._protocol.expect(1)[0]
+                self._transport.write(frame)
+                result = self._parse_reply(
+                    await asyncio.wait_for(reply, self.warm_up.probe_timeout))
+            except asyncio.TimeoutError:
+                if reply is not None:
+                    self._protocol.timed_out([reply])
+                result = None
+            except OSError:
+                self.warm_up.finish()
+                raise
+            if self._is_ready(result):
+                break
+            await asyncio.sleep(max(0, self.warm_up.probe_interval - (time.monotonic() - started)))
+        self.warm_up.finish()
+
+    async def _probe(self):
+        """Coroutine version of TV._probe."""
+        if not self.circuit_breaker.probe_due():
+            raise UnavailableError('TV is not answering')
+        try:
+            await self._exchange([self._commands.frame('power', '?')], [])
+        except OSError as error:
+            self.circuit_breaker.record_failure()
+            raise UnavailableError('TV is still not answering') from error
+        self.circuit_breaker.record_success()
+        self._settings.clear()
+
+    async def _exchange(self, frames, results, interval=0):
+        """Coroutine version of TV._exchange."""
+        await self.open()
+        await self._protocol.discard_input(self._timeout)
+        data = b''.join(frames)
+        replies = self._protocol.expect(len(frames))
+        _LOGGER.debug('*Sending "%s"', data)
+        if interval:
+            for frame in frames[:-1]:
+                self._transport.write(frame)
+                await asyncio.sleep(interval)
+            self._transport.write(frames[-1])
+        else:
+            self._transport.write(data)
+        self.stats.bytes_sent += len(data)
+        sent = time.perf_counter()
+        try:
+            for frame, reply in zip(frames, replies):
+                results.append(self._parse_tracked(
+                    frame, await asyncio.wait_for(reply, self._timeout), sent))
+        except UnexpectedReplyError:
+            # The reply to the frame is still to come
+            self._protocol.timed_out(replies)
+            self._protocol.skip_reply()
+            raise
+        except asyncio.TimeoutError:
+            self._protocol.timed_out(replies)
+            self.stats.timeouts += 1
+            import serial
+            raise serial.SerialTimeoutException(
+                'Connection timed out! No reply to {}'.format(data))
+
+    async def _send_commands(self, commands):
+        """Coroutine version of TV._send_commands."""
+        if self._all_queries(commands):
+            priority = PRIORITY_POLL
+        else:
+            priority = PRIORITY_USER
+        results = await self._send_frames([self._commands.frame(name, opt)
+                                           for name, opt in commands], priority)
+        self._track_replies(commands, results)
+        return results
+
+    def _track_replies(self, commands, results):
+        warming_up = self.warm_up.active
+        super()._track_replies(commands, results)
+        if self.warm_up.active and not warming_up:
+            # Probe right away instead of waiting for the next command
+            self._submit(self._wait_until_ready, PRIORITY_USER).add_done_callback(
+                _ignore_result)
+
+    async def run_scene(self, steps):
+        """
+        Description:
+
+            Coroutine version of TV.run_scene().
+            The scene is one job of the worker,
+            polls queued meanwhile are sent after it.
+        """
+        commands, delays = self._scene_plan(steps)
+        return await asyncio.shield(
+            self._submit(partial(self._run_scene, commands, delays), PRIORITY_USER))
+
+    async def _run_scene(self, commands, delays):
+        results = [None] * len(commands)
+        for indexes, batch, delay in self._scene_batches(commands, delays):
+            if batch:
+                try:
+                    replies = await self._send_with_retries(
+                        [self._commands.frame(name, opt) for name, opt in batch],
+                        queries=self._all_queries(batch))
+                except OSError as error:
+                    self._scene_failed(results, indexes, error)
+                    break
+                self._track_replies(batch, replies)
+                for index, result in zip(indexes, replies):
+                    results[index] = result
+            if delay:
+                await asyncio.sleep(delay)
+        return results
+
+    async def remote_button(self, opt):
+        """Coroutine version of TV.remote_button()."""
+        return await self.press(opt)
+
+    async def press(self, key, repeat=1, interval=0):
+        """Coroutine version of TV.press()."""
+        frame = self._press_frame(key, repeat)
+        return self._all_acknowledged(await self._send_frames([frame] * repeat, interval=interval))
+
+    async def _send_command(self, name, parameter=''):
+        return (await self._send_commands([(self._command_key(name), parameter)]))[0]
+
+    async def _send_setting(self, name, opt='?'):
+        if opt != '?' and name in self._settings and self._settings[name] == opt:
+            return True
+        return await self._send_command(name, opt)
+
+    async def _send_field(self, field, opt, max_age):
+        cached = self._cached(field, opt, max_age)
+        if cached is not None:
+            return cached
+        return await self._send_command(self._STATUS_QUERIES[field], opt)
+
+    async def query_many(self, names):
+        """Coroutine version of TV.query_many()."""
+        return await self._send_commands([self._query_command(name)
+                                          for name in names])
+
+    async def status(self, fields=Status._fields, max_age=None):
+        """Coroutine version of TV.status()."""
+        stale = self._stale_fields(fields, max_age)
+        replies = []
+        if stale:
+            replies = await self.query_many([self._STATUS_QUERIES[field] for field in stale])
+        return self._status_from_replies(fields, stale, replies)
+
+    @property
+    def pending_volume(self):
+        """Volume queued by queue_volume() and not written yet, or None."""
+        return self._volume_target
+
+    def queue_volume(self, volume=None, step=0):
+        """
+        Description:
+
+            Coalesce volume changes arriving in quick succession.
+            The new target is returned at once; only the latest target
+            is written, once no further change arrived for volume_delay.
+            Errors of that write are logged, the next poll shows
+            the actual volume.
+
+        Arguments:
+            volume: integer (optional)
+                0 - 100: Volume Level
+                Defaults to the pending or last known volume
+            step: integer (optional)
+                Relative change added to volume
+
+        Returns:
+            The volume that will be written,
+            or None if the current volume is unknown
+        """
+        if volume is None:
+            volume = self.state.get('volume') if self._volume_target is None else self._volume_target
+            if volume is None:
+                return None
+        self._volume_target = max(0, min(100, int(volume) + step))
+        if self._volume_timer is not None:
+            self._volume_timer.cancel()
+        self._volume_timer = asyncio.get_running_loop().call_later(
+            self._volume_delay, self._start_volume_write)
+        return self._volume_target
+
+    def _start_volume_write(self):
+        self._volume_timer = None
+        self._volume_task = asyncio.create_task(self._write_volume())
+
+    async def _write_volume(self):
+        target = self._volume_target
+        try:
+            if await self.volume(target) is False:
+                _LOGGER.warning('TV refused volume %s', target)
+        except OSError as error:
+            _LOGGER.warning('Could not set volume %s: %s', target, error)
+        finally:
+            if self._volume_target == target and self._volume_timer is None:
+                self._volume_target = None
+
+    async def info(self):
+        """Coroutine version of TV.info()."""
+        return dict(zip(self._INFO_QUERIES, await self.query_many(self._INFO_QUERIES)))
+
+    async def input(self, opt='?', max_age=None):
+        """Coroutine version of TV.input()."""
+        if opt == '?':
+            cached = self._cached('input', opt, max_age)
+            if cached is not None:
+                return cached
+            return self._input_from_index(await self._send_command('input_index'))
+        key = self.inputs.key(opt)
+        if key is None:
+            return False
+        return await self._send_command('input.%s.command' % key)
+
+    async def digital_channel_cable(self, opt1='?', opt2=0, max_age=None):
+        """Coroutine version of TV.digital_channel_cable()."""
+        if opt1 == '?':
+            parameter = '?'
+        elif self.command['digital_channel_cable_minor'] == '':
+            parameter = str(opt1).rjust(4, "0")
+        else:
+            await self._send_command('digital_channel_cable_minor', str(opt1).rjust(3, "0"))
+            parameter = str(opt2).rjust(3, "0")
+        return await self._send_field('digital_channel_cable', parameter, max_age)
+
+    async def channel_up(self):
+        """Coroutine version of TV.channel_up()."""
+        await self._send_command('channel_up')
+
+    async def channel_down(self):
+        """Coroutine version of TV.channel_down()."""
+        await self._send_command('channel_down')
+
+
+class AsyncIpTV(AsyncTV):
+    """
+    Description:
+        asyncio counterpart of IpTV
+
+        The session is kept open between commands.
+        When the TV closes an idle session,
+        the next command connects and logs in again.
+    """
+
+    def __init__(self, host, port=IP_PORT, username=None, password=None,
+                 timeout=2, command_map='us', retries=2, volume_delay=0.3,
+                 login_timeout=2):
+        """
+        Initialize the client.
+        """
+        super().__init__('{}:{}'.format(host, port), timeout=timeout,
+                         command_map=command_map, retries=retries,
+                         volume_delay=volume_delay)
+        self._address = (host, port)
+        self._username = username
+        self._password = password or ''
+        self._login_timeout = login_timeout
+
+    async def _connect(self, loop):
+        login = None
+        if self._username is not None:
+            login = LoginHandshake(self._username, self._password)
+        transport, protocol = await asyncio.wait_for(
+            loop.create_connection(partial(_AquosProtocol, login), *self._address),
+            self._timeout)
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            await protocol.logged_in(self._login_timeout)
+        except BaseException:
+            transport.close()
+            raise
+        return transport, protocol
@@ -0,0 +1,316 @@
+"""Command maps of Sharp Aquos TVs."""
+import json
+import logging
+import os
+import threading
+from types import MappingProxyType
+
+_LOGGER = logging.getLogger(__name__)
+
+VALID_COMMAND_MAPS = ["eu", "us", "cn", "jp"]
+# Commands are four characters, longer commands already carry their parameter
+COMMAND_LENGTH = 4
+FRAME_LENGTH = 8
+TERMINATOR = b'\r\n'
+# Command of the remote keys addressed by number
+REMOTE_KEY_COMMAND = 'RCKY'
+# Commands carrying their parameter that only report about the TV
+READ_ONLY_COMMANDS = frozenset(('name', 'model', 'version', 'ip_version'))
+
+
+def _flatten(command_map, prefix=''):
+    for name, value in command_map.items():
+        key = prefix + str(name)
+        if isinstance(value, dict):
+            yield from _flatten(value, key + '.')
+        elif isinstance(value, str) and value != '' and not (prefix and name == 'name'):
+            yield key, value
+
+
+class CommandTable(object):
+    """
+    Description:
+        Immutable table of wire frames compiled from a command map
+
+        Keys are the names used in the command map.
+        Nested commands are addressed by their path,
+        e.g. "input.hdmi_1.command" or "remote.play".
+        Commands without parameter are stored as complete frames.
+    """
+    __slots__ = ('_prefixes', '_frames')
+
+    def __init__(self, command_map):
+        prefixes = {}
+        for key, command in _flatten(command_map):
+            if len(command) > FRAME_LENGTH or not command.isascii():
+                raise ValueError("%s is not a valid command for %s" % (command, key))
+            prefixes[key] = command.encode('ascii')
+        self._prefixes = MappingProxyType(prefixes)
+        self._frames = MappingProxyType({key: prefix.ljust(FRAME_LENGTH) + TERMINATOR
+                                         for key, prefix in prefixes.items()
+                                         if len(prefix) > COMMAND_LENGTH})
+
+    def __contains__(self, key):
+        return key in self._prefixes
+
+    def __iter__(self):
+        return iter(self._prefixes)
+
+    def __len__(self):
+        return len(self._prefixes)
+
+    def has_parameter(self, key):
+        """Return True if the command takes a parameter."""
+        return key not in self._frames
+
+    def is_query(self, key, opt=''):
+        """Return True if sending key with opt only reads a setting."""
+        if opt == '?' or (opt == '' and key in READ_ONLY_COMMANDS):
+            return True
+        prefix = self._prefixes.get(key)
+        return opt == '' and prefix is not None and prefix.endswith(b'?')
+
+    def frame(self, key, opt=''):
+        """
+        Description:
+
+            Return the wire frame for command key with parameter opt
+
+        """
+        if opt == '':
+            frame = self._frames.get(key)
+            if frame is not None:
+                return frame
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            raise ValueError(key + " command is not in list")
+        return b''.join((prefix, str(opt).encode('ascii'))).ljust(FRAME_LENGTH) + TERMINATOR
+
+
+class InputTable(object):
+    """
+    Description:
+        Lookup tables for the inputs of a command map
+
+        An input can be addressed by its key ("hdmi_1"),
+        its name ("HDMI 1") or its index (1).
+    """
+    __slots__ = ('_names', '_indexes', '_by_name', '_by_index')
+
+    def __init__(self, inputs):
+        self._names = MappingProxyType({key: entry['name'] for key, entry in inputs.items()})
+        self._indexes = MappingProxyType({key: entry['index'] for key, entry in inputs.items()})
+        self._by_name = MappingProxyType({name: key for key, name in self._names.items()})
+        by_index = {}
+        for key, index in self._indexes.items():
+            by_index.setdefault(index, key)
+        self._by_index = MappingProxyType(by_index)
+
+    def __contains__(self, opt):
+        return self.key(opt) is not None
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def items(self):
+        """Return (key, name) pairs in map order."""
+        return self._names.items()
+
+    def names(self):
+        """Return the input names in map order."""
+        return list(self._names.values())
+
+    def key(self, opt):
+        """Return the key of an input given by key, name or index, or None."""
+        if isinstance(opt, str):
+            if opt in self._names:
+                return opt
+            return self._by_name.get(opt)
+        if isinstance(opt, bool):
+            # False is what the TV answers with ERR, not input 0
+            return None
+        return self._by_index.get(opt)
+
+    def name(self, opt):
+        """Return the name of an input given by key, name or index, or None."""
+        return self._names.get(self.key(opt))
+
+    def index(self, opt):
+        """Return the index of an input given by key, name or index, or None."""
+        return self._indexes.get(self.key(opt))
+
+
+class RemoteTable(object):
+    """
+    Description:
+        Pre-encoded frames of the remote control keys of a command map
+
+        A key is addressed by its name ("play", "5")
+        or, for "RCKY" keys, by its number, the parameter of its command
+        (16 for "RCKY0016"). Numbers are looked up before names,
+        names before numbers given as strings. Other commands,
+        e.g. "IRCO0101" or "TDCH1", have no number.
+    """
+    __slots__ = ('_frames', '_by_code')
+
+    def __init__(self, remote):
+        frames = {}
+        by_code = {}
+        for name, command in remote.items():
+            if command == '':
+                # Not available in this region
+                continue
+            if not isinstance(command, str) or len(command) > FRAME_LENGTH or not command.isascii():
+                raise ValueError("%s is not a valid remote key for %s" % (command, name))
+            name = str(name)
+            frames[name] = command.encode('ascii').ljust(FRAME_LENGTH) + TERMINATOR
+            code = command[COMMAND_LENGTH:]
+            if command[:COMMAND_LENGTH] == REMOTE_KEY_COMMAND and code.isdigit():
+                by_code.setdefault(int(code), name)
+        self._frames = MappingProxyType(frames)
+        self._by_code = MappingProxyType(by_code)
+
+    def __contains__(self, key):
+        return self.name(key) is not None
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def names(self):
+        """Return the key names in map order."""
+        return list(self._frames)
+
+    def name(self, key):
+        """Return the name of a key given by name or number, or None."""
+        if isinstance(key, bool):
+            return None
+        if isinstance(key, int):
+            name = self._by_code.get(key)
+            if name is not None:
+                return name
+            key = str(key)
+        if key in self._frames:
+            return key
+        if isinstance(key, str) and key.isdigit():
+            return self._by_code.get(int(key))
+        return None
+
+    def frame(self, key):
+        """Return the wire frame of a key given by name or number."""
+        name = self.name(key)
+        if name is None:
+            raise ValueError("%s is not a remote key" % (key,))
+        return self._frames[name]
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(val) for key, val in value.items()})
+    return value
+
+
+class CommandMap(object):
+    """
+    Description:
+        Parsed and compiled command map of one region
+
+        command: the map as loaded from yaml, read only
+        commands: CommandTable of the map
+        inputs: InputTable of the map
+        remote: RemoteTable of the map
+    """
+    __slots__ = ('region', 'command', 'commands', 'inputs', 'remote')
+
+    def __init__(self, region, command_map):
+        self.region = region
+        self.command = _freeze(command_map)
+        self.commands = CommandTable(command_map)
+        self.inputs = InputTable(command_map['input'])
+        self.remote = RemoteTable(command_map.get('remote', {}))
+
+
+_COMMAND_MAPS = {}
+_COMMAND_MAPS_LOCK = threading.Lock()
+
+
+_COMMANDS_DIR = os.path.join(os.path.dirname(__file__), 'commands')
+_CACHE_DIR = os.path.join(_COMMANDS_DIR, '__pycache__')
+
+
+def _parse_yaml(data):
+    # PyYAML is only needed when the cache is missing or outdated
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(data, Loader=loader)
+
+
+def _read_cache(path):
+    try:
+        with open(path, encoding='utf-8') as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(path, cache):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as stream:
+            json.dump(cache, stream, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+    except OSError as error:
+        _LOGGER.debug('Could not write command map cache %s: %s', path, error)
+
+
+def _read_command_map(region):
+    """
+    Description:
+
+        Read commands/<region>.yaml.
+        The parsed map is cached as json in commands/__pycache__,
+        keyed by the modification time and sha256 of the yaml file,
+        so it is only parsed with PyYAML after the file changed.
+    """
+    path = os.path.join(_COMMANDS_DIR, '%s.yaml' % region)
+    cache_path = os.path.join(_CACHE_DIR, '%s.json' % region)
+    stat = os.stat(path)
+    cache = _read_cache(cache_path)
+    if cache is not None and cache.get('mtime_ns') == stat.st_mtime_ns:
+        return cache['map']
+    import hashlib
+    with open(path, 'rb') as stream:
+        data = stream.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if cache is None or cache.get('sha256') != digest:
+        cache = {'sha256': digest, 'map': _parse_yaml(data)}
+    cache['mtime_ns'] = stat.st_mtime_ns
+    _write_cache(cache_path, cache)
+    return cache['map']
+
+
+def get_command_map(region):
+    """
+    Description:
+
+        Returns the CommandMap of a region.
+        Each map is read from the package once
+        and shared by all TV instances.
+
+    Arguments:
+        region: one of VALID_COMMAND_MAPS
+    """
+    command_map = _COMMAND_MAPS.get(region)
+    if command_map is not None:
+        return command_map
+    if region not in VALID_COMMAND_MAPS:
+        raise ValueError("command_layout should be one of %s, not %s" % (str(VALID_COMMAND_MAPS), region))
+    with _COMMAND_MAPS_LOCK:
+        if region not in _COMMAND_MAPS:
+            _COMMAND_MAPS[region] = CommandMap(region, _read_command_map(region))
+        return _COMMAND_MAPS[region]
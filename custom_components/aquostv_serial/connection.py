@@ -0,0 +1,511 @@
+"""Serial and network connections to a Sharp Aquos TV."""
+import logging
+import select
+import socket
+
+from .retry import ReopenBackoff
+
+_LOGGER = logging.getLogger(__name__)
+
+# Port settings, same values as serial.STOPBITS_ONE, EIGHTBITS and PARITY_NONE
+STOPBITS_ONE = 1
+EIGHTBITS = 8
+PARITY_NONE = 'N'
+
+# TCP port of the IP control protocol
+IP_PORT = 10002
+
+
+class LoginError(IOError):
+    """The TV closed the session after the password, the login is wrong."""
+
+
+class FrameBuffer(object):
+    """
+    Description:
+        Split a byte stream into "\r" terminated frames.
+        Bytes following the last complete frame are kept
+        until the rest of their frame arrives.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._skip = False
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        if self._skip:
+            # Drop the rest of a frame discarded by resync()
+            end = data.find(b'\r')
+            if end < 0:
+                return
+            data = data[end + 1:]
+            self._skip = False
+        self._buffer += data
+
+    def pop(self):
+        """Return the next complete frame, or None."""
+        while True:
+            end = self._buffer.find(b'\r')
+            if end < 0:
+                return None
+            frame = bytes(self._buffer[:end + 1])
+            del self._buffer[:end + 1]
+            # Blank frames, e.g. the line break after a login, are no reply
+            if frame.strip():
+                return frame
+
+    def peek(self):
+        """Return everything buffered, without dropping it."""
+        return bytes(self._buffer)
+
+    def clear(self):
+        """Return and drop everything buffered."""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def resync(self):
+        """
+        Description:
+
+            Drop everything buffered. When the buffer ends inside
+            a frame, the rest of that frame is dropped as it arrives,
+            up to the next "\r". A line break is not part of a frame.
+
+        Returns:
+            the bytes dropped from the buffer
+        """
+        end = self._buffer.rfind(b'\r')
+        if self._buffer[end + 1:].strip():
+            self._skip = True
+        return self.clear()
+
+
+class LoginHandshake(object):
+    """
+    Description:
+        Answers the "Login:" and "Password:" prompts
+        a TV with IP control sends after a client connected
+
+        Feed it everything received until done is set,
+        and send what feed() returns. Bytes received after
+        the last prompt are returned by rest().
+    """
+
+    def __init__(self, username, password):
+        self._buffer = bytearray()
+        self._answers = [(b'Login:', username), (b'Password:', password)]
+        self.started = False
+
+    @property
+    def done(self):
+        return not self._answers
+
+    def feed(self, data):
+        """Return the bytes to send in reply to data, may be empty."""
+        self.started = True
+        self._buffer += data
+        answer = b''
+        while self._answers:
+            prompt, value = self._answers[0]
+            end = self._buffer.find(prompt)
+            if end < 0:
+                break
+            del self._buffer[:end + len(prompt)]
+            del self._answers[0]
+            answer += value.encode('utf-8') + b'\r'
+        return answer
+
+    def rest(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class SerialConnection(object):
+    """
+    Description:
+        Serial port kept open across commands
+
+        The port is opened once and reused.
+        Call discard_input() before writing the frames of an exchange,
+        so that replies still on the way from an earlier exchange are
+        not taken for replies to the new one. The frames written and
+        the replies read are counted, after a timeout the replies
+        still owed are awaited and dropped.
+        A timeout leaves the port open.
+        Any other error, e.g. from an unplugged USB adapter,
+        closes the port. It is reopened on the next write,
+        with reopen_backoff spacing out attempts that fail.
+        open_count counts the times the port was opened,
+        so clients notice a reopen, e.g. of a reset TV.
+
+        exclusive: lock the port, opening it fails
+            while another process holds it
+    """
+
+    def __init__(self, url, baudrate=9600, stopbits=STOPBITS_ONE,
+                 bytesize=EIGHTBITS, parity=PARITY_NONE,
+                 timeout=2, write_timeout=2, exclusive=False):
+        import serial
+        self._serial = serial
+        self._port = serial.serial_for_url(url, do_not_open=True)
+        if exclusive:
+            self._port.exclusive = True
+        self._port.baudrate = baudrate
+        self._port.stopbits = stopbits
+        self._port.bytesize = bytesize
+        self._port.parity = parity
+        self._port.timeout = timeout
+        self._port.write_timeout = write_timeout
+        self._frames = FrameBuffer()
+        self._owed = 0
+        self.reopen_backoff = ReopenBackoff()
+        self.open_count = 0
+        self.open()
+
+    @property
+    def is_open(self):
+        return self._port.is_open
+
+    def open(self):
+        """
+        Description:
+
+            Open the port if it is closed
+
+        Raises:
+            serial.SerialException if the port cannot be opened,
+            or the last attempt failed too recently
+        """
+        if self._port.is_open:
+            return
+        wait = self.reopen_backoff.wait()
+        if wait > 0:
+            raise self._serial.SerialException(
+                'Reopening {} in {:.1f} s'.format(self._port.port, wait))
+        try:
+            self._port.open()
+        except (OSError, ValueError):
+            self.reopen_backoff.record_failure()
+            raise
+        self.reopen_backoff.record_success()
+        self.open_count += 1
+        self._frames.clear()
+        self._owed = 0
+
+    def close(self):
+        try:
+            self._port.close()
+        except OSError as error:
+            _LOGGER.debug('Error closing %s: %s', self._port.port, error)
+
+    def discard_input(self, wait=True):
+        """
+        Description:
+
+            Drop everything received so far, before the frames of
+            a new exchange are written. Replies still owed for frames
+            written earlier are awaited first, until they arrived
+            or nothing arrived for the timeout of the port.
+
+        Arguments:
+            wait: False to not await the replies owed, e.g. when
+                they can only answer the same query as the next frame
+        """
+        self.open()
+        self._discard_owed(wait)
+        try:
+            waiting = self._port.in_waiting
+            if waiting:
+                self._frames.feed(self._port.read(waiting))
+        except OSError as error:
+            self._failed(error)
+            raise
+        # The rest of a partial reply is dropped as it arrives
+        self._frames.resync()
+
+    def _discard_owed(self, wait):
+        while wait and self._owed > 0:
+            try:
+                frame = self._read_frame()
+            except self._serial.SerialTimeoutException:
+                _LOGGER.debug('%s replies owed by %s did not arrive', self._owed, self._port.port)
+                break
+            else:
+                _LOGGER.debug('Dropping late reply %r from %s', frame, self._port.port)
+        self._owed = 0
+
+    def skip_reply(self):
+        """Expect one more reply, the last one read was not for the frame it was read for."""
+        self._owed += 1
+
+    def write(self, data):
+        """Write data, see discard_input()."""
+        self.open()
+        self._owed += data.count(b'\r')
+        try:
+            self._port.write(data)
+            self._port.flush()
+        except OSError as error:
+            self._failed(error)
+            raise
+
+    def read_frame(self, timeout=None):
+        """
+        Description:
+
+            Return the next "\r" terminated frame the TV sends
+
+        Arguments:
+            timeout: seconds to wait instead of the timeout of the port
+        """
+        if timeout is None:
+            return self._read_frame()
+        saved = self._port.timeout
+        self._port.timeout = timeout
+        try:
+            return self._read_frame()
+        finally:
+            self._port.timeout = saved
+
+    def _read_frame(self):
+        while True:
+            frame = self._frames.pop()
+            if frame is not None:
+                self._owed = max(0, self._owed - 1)
+                return frame
+            try:
+                # Wait for one byte, then take everything already received
+                data = self._port.read(self._port.in_waiting or 1)
+            except OSError as error:
+                self._failed(error)
+                raise
+            if not data:
+                raise self._serial.SerialTimeoutException(
+                    'Connection timed out! Last received bytes {}'
+                    .format([hex(a) for a in self._frames.peek()]))
+            self._frames.feed(data)
+
+    def _failed(self, error):
+        if isinstance(error, self._serial.SerialTimeoutException):
+            return
+        _LOGGER.warning('Closing %s after error: %s', self._port.port, error)
+        self.close()
+
+
+class TcpConnection(object):
+    """
+    Description:
+        Network connection to the IP control port of a TV,
+        with the same methods and exceptions as SerialConnection
+
+        One logged in session is kept open across commands.
+        TVs close sessions that were idle for a while;
+        a session the TV closed is noticed by discard_input()
+        and replaced by a new one, logged in again.
+        Without a username no login is attempted. When the TV
+        sends no prompt within login_timeout, it is assumed
+        to have the login disabled. A TV closing the session
+        after the password rejected the login, LoginError is raised
+        and reopen_backoff spaces out further attempts.
+        open_count counts the sessions opened.
+    """
+
+    def __init__(self, host, port=IP_PORT, username=None, password=None,
+                 timeout=2, login_timeout=2):
+        import serial
+        self._serial = serial
+        self._address = (host, port)
+        self._username = username
+        self._password = password or ''
+        self._timeout = timeout
+        self._login_timeout = login_timeout
+        self._socket = None
+        self._frames = FrameBuffer()
+        self._owed = 0
+        self.reopen_backoff = ReopenBackoff()
+        self.open_count = 0
+        self.open()
+
+    @property
+    def is_open(self):
+        return self._socket is not None
+
+    def open(self):
+        """
+        Description:
+
+            Connect and log in if there is no session
+
+        Raises:
+            OSError if the TV cannot be reached or the login fails,
+            serial.SerialException if the last attempt failed too recently
+        """
+        if self._socket is not None:
+            return
+        wait = self.reopen_backoff.wait()
+        if wait > 0:
+            raise self._serial.SerialException(
+                'Reconnecting to {}:{} in {:.1f} s'.format(*self._address, wait))
+        self._frames.clear()
+        self._owed = 0
+        try:
+            self._socket = socket.create_connection(self._address, self._timeout)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if self._username is not None:
+                self._login()
+        except OSError:
+            self.close()
+            self.reopen_backoff.record_failure()
+            raise
+        self.reopen_backoff.record_success()
+        self.open_count += 1
+        self._socket.settimeout(self._timeout)
+
+    def _login(self):
+        handshake = LoginHandshake(self._username, self._password)
+        self._socket.settimeout(self._login_timeout)
+        while not handshake.done:
+            try:
+                data = self._socket.recv(1024)
+            except socket.timeout:
+                if not handshake.started:
+                    _LOGGER.debug('No login prompt from %s:%s', *self._address)
+                    return
+                raise self._serial.SerialException(
+                    'Login to {}:{} failed, no password prompt'.format(*self._address))
+            if not data:
+                raise self._serial.SerialException(
+                    'Login to {}:{} failed, connection closed'.format(*self._address))
+            answer = handshake.feed(data)
+            if answer:
+                self._socket.sendall(answer)
+        rest = handshake.rest()
+        if not rest:
+            rest = self._login_reply()
+        self._frames.feed(rest)
+
+    def _login_reply(self):
+        # The TV answers an accepted login with a line break,
+        # it closes the session right away after a wrong one
+        try:
+            data = self._socket.recv(1024)
+        except socket.timeout:
+            return b''
+        if not data:
+            raise LoginError('Login to {}:{} failed, wrong username or password'
+                             .format(*self._address))
+        return data
+
+    def close(self):
+        if self._socket is None:
+            return
+        try:
+            self._socket.close()
+        except OSError as error:
+            _LOGGER.debug('Error closing %s:%s: %s', *self._address, error)
+        self._socket = None
+
+    def discard_input(self, wait=True):
+        """
+        Description:
+
+            Same as SerialConnection.discard_input(),
+            a session the TV closed is replaced by a new one
+        """
+        if self._socket is not None and self._closed_by_peer():
+            _LOGGER.debug('%s:%s closed the session, logging in again', *self._address)
+            self.close()
+        self.open()
+        self._discard_owed(wait)
+        self._socket.setblocking(False)
+        try:
+            while True:
+                data = self._socket.recv(1024)
+                if not data:
+                    raise ConnectionResetError('Connection closed by the TV')
+                self._frames.feed(data)
+        except BlockingIOError:
+            pass
+        except OSError as error:
+            self._failed(error)
+            raise
+        finally:
+            if self._socket is not None:
+                self._socket.settimeout(self._timeout)
+        self._frames.resync()
+
+    def _discard_owed(self, wait):
+        while wait and self._owed > 0:
+            try:
+                frame = self._read_frame()
+            except self._serial.SerialTimeoutException:
+                _LOGGER.debug('%s replies owed by %s:%s did not arrive',
+                              self._owed, *self._address)
+                break
+            else:
+                _LOGGER.debug('Dropping late reply %r from %s:%s', frame, *self._address)
+        self._owed = 0
+
+    def skip_reply(self):
+        """Same as SerialConnection.skip_reply()."""
+        self._owed += 1
+
+    def write(self, data):
+        """Write data, see discard_input()."""
+        self.open()
+        self._owed += data.count(b'\r')
+        try:
+            self._socket.sendall(data)
+        except OSError as error:
+            self._failed(error)
+            raise
+
+    def _closed_by_peer(self):
+        # An idle session has nothing to read, unless the TV closed it
+        try:
+            if not select.select([self._socket], [], [], 0)[0]:
+                return False
+            return not self._socket.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def read_frame(self, timeout=None):
+        """Same as SerialConnection.read_frame()."""
+        if timeout is None:
+            return self._read_frame()
+        self._socket.settimeout(timeout)
+        try:
+            return self._read_frame()
+        finally:
+            if self._socket is not None:
+                self._socket.settimeout(self._timeout)
+
+    def _read_frame(self):
+        while True:
+            frame = self._frames.pop()
+            if frame is not None:
+                self._owed = max(0, self._owed - 1)
+                return frame
+            try:
+                data = self._socket.recv(1024)
+            except socket.timeout:
+                raise self._serial.SerialTimeoutException(
+                    'Connection timed out! Last received bytes {}'
+                    .format([hex(a) for a in self._frames.peek()]))
+            except OSError as error:
+                self._failed(error)
+                raise
+            if not data:
+                error = ConnectionResetError('Connection closed by the TV')
+                self._failed(error)
+                raise error
+            self._frames.feed(data)
+
+    def _failed(self, error):
+        _LOGGER.warning('Closing %s:%s after error: %s', *self._address, error)
+        self.close()
@@ -0,0 +1,137 @@
+"""Identity and capabilities of Sharp Aquos TVs, kept across restarts."""
+
+# Refusals in a row of a Status field, while the TV is on,
+# before the field counts as not supported by the model
+UNSUPPORTED_AFTER = 3
+# Inputs the refusals must have been seen on, some fields
+# are only reported for some inputs
+UNSUPPORTED_INPUTS = 2
+
+
+class DeviceCache(object):
+    """
+    Description:
+        The info of each TV, keyed by port or host,
+        and the Status fields each model refuses to report
+
+        Created from the dict returned by as_dict(),
+        so it can be stored as json. listener is called
+        without arguments after every change, e.g. to save it.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self._devices = {url: dict(info) for url, info in data.get('devices', {}).items()}
+        self._unsupported = {model: set(fields)
+                             for model, fields in data.get('unsupported', {}).items()}
+        self._records = {}
+        self.listener = None
+
+    def device(self, url):
+        """Return the DeviceRecord of the TV on url."""
+        record = self._records.get(url)
+        if record is None:
+            record = self._records[url] = DeviceRecord(self, url)
+        return record
+
+    def as_dict(self):
+        return {'devices': self._devices,
+                'unsupported': {model: sorted(fields)
+                                for model, fields in self._unsupported.items()}}
+
+    def _changed(self):
+        if self.listener is not None:
+            self.listener()
+
+
+class DeviceRecord(object):
+    """
+    Description:
+        Cached info and capabilities of the TV on one port or host
+
+        info: dict as returned by TV.info(), None until the TV
+            reported its model once
+        validated: the TV confirmed info since the record was created
+        unsupported: Status fields the model of the TV refuses,
+            empty while the model is unknown
+    """
+
+    def __init__(self, cache, url):
+        self._cache = cache
+        self.url = url
+        self.validated = False
+        self._refusals = {}
+
+    @property
+    def info(self):
+        return self._cache._devices.get(self.url)
+
+    @property
+    def model(self):
+        info = self.info
+        return None if info is None else info.get('model')
+
+    @property
+    def unsupported(self):
+        return frozenset(self._cache._unsupported.get(self.model, ()))
+
+    def update_info(self, info):
+        """
+        Description:
+
+            Store info as reported by TV.info().
+            Ignored unless the TV reported its model,
+            it refuses to while it is off. When the same model
+            reports a new firmware version, the fields unsupported
+            by the model are learned again. A different model keeps
+            what was learned about it, e.g. from another TV.
+
+        Returns:
+            True if the stored info changed
+        """
+        if not isinstance(info.get('model'), str):
+            return False
+        self.validated = True
+        if info == self.info:
+            return False
+        old = self.info
+        if old is not None and old.get('model') == info['model'] \
+                and old.get('version') != info.get('version'):
+            self._cache._unsupported.pop(info['model'], None)
+        self._cache._devices[self.url] = dict(info)
+        self._refusals.clear()
+        self._cache._changed()
+        return True
+
+    def answered(self, field):
+        """Record that the TV reported field."""
+        self._refusals.pop(field, None)
+
+    def refused(self, field, source=None):
+        """
+        Description:
+
+            Record that the TV, while on, refused to report field.
+            After UNSUPPORTED_AFTER refusals in a row, seen on at least
+            UNSUPPORTED_INPUTS inputs, the field is unsupported
+            by the model for good.
+
+        Arguments:
+            source: the input selected on the TV, None if unknown
+
+        Returns:
+            True if the field became unsupported
+        """
+        model = self.model
+        if model is None or field in self.unsupported:
+            return False
+        count, sources = self._refusals.get(field, (0, frozenset()))
+        if source is not None:
+            sources |= {source}
+        self._refusals[field] = count + 1, sources
+        if count + 1 < UNSUPPORTED_AFTER or len(sources) < UNSUPPORTED_INPUTS:
+            return False
+        del self._refusals[field]
+        self._cache._unsupported.setdefault(model, set()).add(field)
+        self._cache._changed()
+        return True
@@ -0,0 +1,125 @@
+"""Find Sharp Aquos TVs on the serial ports of this machine."""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import logging
+import os
+
+from .commands import VALID_COMMAND_MAPS, get_command_map
+from .connection import SerialConnection
+from .replies import parse_reply
+
+_LOGGER = logging.getLogger(__name__)
+
+# Serial ports probed, stable by-id names first
+PORT_PATTERNS = ('/dev/serial/by-id/*', '/dev/ttyUSB*', '/dev/ttyS*')
+
+# Queries whose command differs between the region maps
+_REGION_QUERIES = ('digital_channel_air', 'digital_channel_cable_major')
+
+FoundTV = collections.namedtuple('FoundTV', ['port', 'name', 'model', 'region', 'regions'])
+FoundTV.__doc__ = """
+    Description:
+        A TV answering on a serial port
+
+        name, model: as reported by the TV, None if it refused them,
+            e.g. while it is off
+        regions: command maps whose region queries the TV answered
+        region: the only one of regions, None if they do not tell,
+            e.g. the EU, CN and JP maps share their region queries
+"""
+
+
+def candidate_ports(patterns=PORT_PATTERNS):
+    """
+    Description:
+
+        Return the serial ports matching patterns.
+        A port reached through several names is returned once,
+        under the name matched first.
+    """
+    ports = []
+    seen = set()
+    for pattern in patterns:
+        for port in sorted(glob.glob(pattern)):
+            device = os.path.realpath(port)
+            if device not in seen:
+                seen.add(device)
+                ports.append(port)
+    return ports
+
+
+def _query(connection, frame):
+    connection.discard_input()
+    connection.write(frame)
+    return parse_reply(connection.read_frame())
+
+
+def probe(port, timeout=0.3, baudrate=9600):
+    """
+    Description:
+
+        Ask the device on port for its model and name,
+        then for the region queries of each command map.
+        Only queries are sent, nothing is changed on the device.
+        The port is locked while probing, a port held
+        by another process is skipped.
+
+    Returns:
+        FoundTV, or None if nothing answered within timeout
+    """
+    try:
+        connection = SerialConnection(port, baudrate=baudrate, timeout=timeout,
+                                      write_timeout=timeout, exclusive=True)
+    except (OSError, ValueError) as error:
+        _LOGGER.debug('Skipping %s, cannot open it: %s', port, error)
+        return None
+    commands = get_command_map('us').commands
+    try:
+        model = _query(connection, commands.frame('model'))
+        name = _query(connection, commands.frame('name'))
+        answered = {}
+        regions = []
+        for region in VALID_COMMAND_MAPS:
+            region_commands = get_command_map(region).commands
+            for key in _REGION_QUERIES:
+                frame = region_commands.frame(key, '?')
+                if frame not in answered:
+                    answered[frame] = not _query(connection, frame).is_error
+                if answered[frame]:
+                    regions.append(region)
+                    break
+    except OSError as error:
+        _LOGGER.debug('No TV on %s: %s', port, error)
+        return None
+    finally:
+        connection.close()
+    return FoundTV(port,
+                   None if name.is_error else name.value,
+                   None if model.is_error else model.value,
+                   regions[0] if len(regions) == 1 else None,
+                   tuple(regions))
+
+
+def discover(ports=None, timeout=0.3, workers=8):
+    """
+    Description:
+
+        Probe serial ports for TVs, up to workers ports at a time.
+        Blocks until every port answered or timed out,
+        so call it from an executor.
+
+    Arguments:
+        ports: ports to probe, default candidate_ports()
+        timeout: seconds to wait for each reply
+
+    Returns:
+        list of FoundTV, in the order of ports
+    """
+    if ports is None:
+        ports = candidate_ports()
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(ports))) as executor:
+        found = executor.map(lambda port: probe(port, timeout), ports)
+        return [tv for tv in found if tv is not None]
@@ -0,0 +1,140 @@
+"""One scheduler for all Sharp Aquos TVs of a Home Assistant instance."""
+import asyncio
+import logging
+import threading
+import time
+
+from .aio import AsyncTV
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds before polling again after a poll raised
+_ERROR_DELAY = 30
+
+
+class AquosHub(object):
+    """
+    Description:
+        Owns the AsyncTV of every configured port or host
+        and polls all TVs from one coordinator task
+
+        Entities on the same port or host share one AsyncTV.
+        Pollers due within batch_window seconds of each other
+        are started together. Each one runs as its own task and
+        is scheduled again when it finished, so a slow TV does not
+        hold up the polls of the others.
+    """
+
+    def __init__(self, batch_window=1.0):
+        self.batch_window = batch_window
+        self._tvs = {}
+        self._users = {}
+        self._lock = threading.Lock()
+        self._due = {}
+        self._running = {}
+        self._wakeup = None
+        self._task = None
+
+    def tv(self, url, factory=AsyncTV, **kwargs):
+        """
+        Description:
+
+            Return the AsyncTV of url, creating it on first use.
+            Call release() when done with it.
+            Reads the command map, so call it from an executor.
+
+        Arguments:
+            url: serial port, or host of an AsyncIpTV
+            factory: AsyncTV or AsyncIpTV
+            kwargs: passed to factory when the TV is created
+        """
+        with self._lock:
+            remote = self._tvs.get(url)
+            if remote is None:
+                remote = self._tvs[url] = factory(url, **kwargs)
+            self._users[url] = self._users.get(url, 0) + 1
+            return remote
+
+    def get(self, url):
+        """Return the AsyncTV of url if one was created, or None."""
+        return self._tvs.get(url)
+
+    async def release(self, remote):
+        """Close the port of remote once no entity uses it any more."""
+        for url, known in list(self._tvs.items()):
+            if known is not remote:
+                continue
+            self._users[url] -= 1
+            if self._users[url] == 0:
+                del self._tvs[url]
+                del self._users[url]
+                await remote.close()
+
+    def schedule(self, poll, delay=0):
+        """
+        Description:
+
+            Run poll after delay seconds, replacing an earlier schedule.
+
+        Arguments:
+            poll: coroutine function returning the seconds
+                until it wants to run again
+        """
+        self._due[poll] = time.monotonic() + delay
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    def unschedule(self, poll):
+        self._due.pop(poll, None)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def close(self):
+        """Stop polling and close all ports."""
+        self._due.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._running.values():
+            task.cancel()
+        self._running.clear()
+        remotes = list(self._tvs.values())
+        self._tvs.clear()
+        self._users.clear()
+        for remote in remotes:
+            await remote.close()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._due:
+            now = time.monotonic()
+            waiting = [due for poll, due in self._due.items() if poll not in self._running]
+            first = min(waiting, default=None)
+            if first is None or first > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(),
+                                           None if first is None else first - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for poll, due in list(self._due.items()):
+                if poll not in self._running and due <= now + self.batch_window:
+                    # Not due again until it finished, unless it is rescheduled
+                    self._due[poll] = float('inf')
+                    self._running[poll] = loop.create_task(self._poll(poll))
+
+    async def _poll(self, poll):
+        try:
+            delay = await poll()
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception('Polling with %s failed', poll)
+            delay = _ERROR_DELAY
+        finally:
+            self._running.pop(poll, None)
+        if poll in self._due:
+            self._due[poll] = min(self._due[poll], time.monotonic() + delay)
+        self._wakeup.set()
@@ -2,7 +2,8 @@
 
 from __future__ import annotations
 
-from collections.abc import Callable
+from collections.abc import Awaitable, Callable, Coroutine
+from functools import partial
 import logging
 from typing import Any, Concatenate
 
@@ -21,107 +22,236 @@ from homeassistant.const import (
     CONF_PORT,
     CONF_TIMEOUT,
     CONF_USERNAME,
+    EVENT_HOMEASSISTANT_STOP,
 )
-from homeassistant.core import HomeAssistant
-from homeassistant.helpers import config_validation as cv
+from homeassistant.core import Event, HomeAssistant, ServiceResponse, SupportsResponse
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv, entity_platform
+from homeassistant.helpers.device_registry import DeviceInfo
+from homeassistant.helpers.discovery import async_load_platform
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.storage import Store
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 
+from .aio import AsyncIpTV
+from .commands import VALID_COMMAND_MAPS
+from .devices import DeviceCache, DeviceRecord
+from .discovery import discover
+from .hub import AquosHub
+from .polling import TV_INPUT_FIELDS, PollSchedule
+from .tv import Status
+
 CONF_TYPE = 'connection_type'
 CONF_IPPORT = 'ip_port'
+CONF_DIAGNOSTICS = 'diagnostics'
+CONF_COMMAND_MAP = 'command_map'
 
 _LOGGER = logging.getLogger(__name__)
 
+DOMAIN = "aquostv_serial"
+DATA_DEVICES = f"{DOMAIN}_devices"
+STORAGE_KEY = f"{DOMAIN}.devices"
+STORAGE_VERSION = 1
+# Seconds to collect changes of the device cache before saving it
+SAVE_DELAY = 10
+
 DEFAULT_NAME = "Sharp Aquos TV"
 DEFAULT_PORT = 10002
 DEFAULT_USERNAME = "admin"
 DEFAULT_PASSWORD = "password"
 DEFAULT_TIMEOUT = 0.5
 DEFAULT_RETRIES = 2
+DEFAULT_COMMAND_MAP = "us"
+# Port setting that uses the first TV found by probing the serial ports
+AUTO_PORT = "auto"
+# Seconds a value learned from the TV is shown without querying it again
+STATE_MAX_AGE = 5
+
+# Names of the av_mode, view_mode and surround values, see tv.TV
+AV_MODES = {
+    1: "standard",
+    2: "movie",
+    3: "game",
+    4: "user",
+    5: "dynamic_fixed",
+    6: "dynamic",
+    7: "pc",
+    8: "xv_color",
+    13: "vintage_movie",
+    14: "standard_3d",
+    15: "movie_3d",
+    16: "game_3d",
+    17: "movie_thx",
+    100: "auto",
+}
+VIEW_MODES = {
+    1: "side_bar",
+    2: "s_stretch",
+    3: "zoom",
+    4: "stretch",
+    5: "normal",
+    6: "zoom_pc",
+    7: "stretch_pc",
+    8: "dot_by_dot",
+    9: "full_screen",
+    10: "auto",
+    11: "original",
+}
+SURROUND_MODES = {
+    1: "on",
+    2: "off",
+    4: "3d_hall",
+    5: "3d_movie",
+    6: "3d_standard",
+    7: "3d_stadium",
+}
 
 PLATFORM_SCHEMA = MEDIA_PLAYER_PLATFORM_SCHEMA.extend(
     {
-        vol.Exclusive(CONF_HOST, CONF_TYPE): {
-            vol.Optional(CONF_IPPORT, default=DEFAULT_PORT): cv.port,
-            vol.Optional(CONF_USERNAME, default=DEFAULT_USERNAME): cv.string,
-            vol.Optional(CONF_PASSWORD, default=DEFAULT_PASSWORD): cv.string
-            },
+        vol.Exclusive(CONF_HOST, CONF_TYPE): cv.string,
         vol.Exclusive(CONF_PORT, CONF_TYPE): cv.string,
+        vol.Optional(CONF_IPPORT, default=DEFAULT_PORT): cv.port,
+        vol.Optional(CONF_USERNAME, default=DEFAULT_USERNAME): cv.string,
+        vol.Optional(CONF_PASSWORD, default=DEFAULT_PASSWORD): cv.string,
         vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
         vol.Optional(CONF_TIMEOUT, default=DEFAULT_TIMEOUT): cv.string,
         vol.Optional("retries", default=DEFAULT_RETRIES): cv.string,
         vol.Optional("power_on_enabled", default=True): cv.boolean,
+        vol.Optional(CONF_DIAGNOSTICS, default=False): cv.boolean,
+        vol.Optional(CONF_COMMAND_MAP): vol.In(VALID_COMMAND_MAPS),
     }
 )
 
-SOURCES = {
-    0: "TV / Antenna",
-    1: "HDMI_IN_1",
-    2: "HDMI_IN_2",
-    3: "HDMI_IN_3",
-    4: "HDMI_IN_4",
-    5: "COMPONENT IN",
-    6: "VIDEO_IN_1",
-    7: "VIDEO_IN_2",
-    8: "PC_IN",
-}
+SERVICE_RUN_SCENE = "run_scene"
+ATTR_STEPS = "steps"
+
+SCENE_STEP_SCHEMA = vol.All(
+    {
+        vol.Optional("command"): cv.string,
+        vol.Optional("value"): vol.Any(int, cv.string),
+        vol.Optional("delay"): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    },
+    cv.has_at_least_one_key("command", "delay"),
+)
+
 
+def _get_hub(hass: HomeAssistant) -> AquosHub:
+    """Return the hub shared by all platform entries."""
+    hub = hass.data.get(DOMAIN)
+    if hub is None:
+        hub = hass.data[DOMAIN] = AquosHub()
 
-def setup_platform(
+        async def _async_close_hub(_event: Event) -> None:
+            await hub.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _async_close_hub)
+    return hub
+
+
+async def _async_load_devices(hass: HomeAssistant) -> DeviceCache:
+    """Load the info and capabilities of the TVs stored by an earlier start."""
+    store: Store[dict[str, Any]] = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+    devices = DeviceCache(await store.async_load())
+    devices.listener = lambda: store.async_delay_save(devices.as_dict, SAVE_DELAY)
+    return devices
+
+
+async def _async_get_devices(hass: HomeAssistant) -> DeviceCache:
+    """Return the device cache shared by all platform entries, loading it once."""
+    task = hass.data.get(DATA_DEVICES)
+    if task is None:
+        task = hass.data[DATA_DEVICES] = hass.async_create_task(_async_load_devices(hass))
+    return await task
+
+
+async def async_setup_platform(
     hass: HomeAssistant,
     config: ConfigType,
-    add_entities: AddEntitiesCallback,
+    async_add_entities: AddEntitiesCallback,
     discovery_info: DiscoveryInfoType | None = None,
 ) -> None:
     """Set up the Sharp Aquos TV platform."""
-    from . import tv
-
     name = config.get(CONF_NAME)
     ipport = config.get(CONF_IPPORT)
     username = config.get(CONF_USERNAME)
     password = config.get(CONF_PASSWORD)
     power_on_enabled = config.get('power_on_enabled')
+    hub = _get_hub(hass)
 
+    retries = int(config.get("retries"))
+    command_map = config.get(CONF_COMMAND_MAP)
+    host = config.get(CONF_HOST)
     if discovery_info:
         _LOGGER.debug('%s', discovery_info)
-        vals = discovery_info.split(':')
-        if len(vals) > 1:
-            ipport = vals[1]
-
-        host = vals[0]
-        #   this call will not work until IP comms added back to tv.py
-        remote = tv.TV(host, ipport, username, password, timeout=20)
-        add_entities([SharpAquosTVDevice(name, remote, power_on_enabled)])
-        return True
+        host, _, discovered_port = discovery_info.partition(':')
+        if discovered_port:
+            ipport = int(discovered_port)
 
-    host = config.get(CONF_HOST)
-    port = config.get(CONF_PORT)
     if host is not None:
-        #   this call will not work until IP comms added back to tv.py
-        remote = tv.TV(host, ipport, username, password, 15, 1)
-    elif port is not None:
-        _LOGGER.debug("Creating AQUOS TV instance at %s", port)
-        remote = tv.TV(port)
-
-    add_entities([SharpAquosTVDevice(name, remote, power_on_enabled)])
-
-
-def _retry[_SharpAquosTVDeviceT: SharpAquosTVDevice, **_P](
-    func: Callable[Concatenate[_SharpAquosTVDeviceT, _P], Any],
-) -> Callable[Concatenate[_SharpAquosTVDeviceT, _P], None]:
-    """Handle query retries."""
-
-    def wrapper(obj: _SharpAquosTVDeviceT, *args: _P.args, **kwargs: _P.kwargs) -> None:
-        """Wrap all query functions."""
-        update_retries = 3
-        while update_retries > 0:
-            try:
-                func(obj, *args, **kwargs)
-                break
-            except (OSError, TypeError, ValueError):
-                update_retries -= 1
-                if update_retries == 0:
-                    obj.set_state(MediaPlayerState.OFF)
+        url = host
+        _LOGGER.debug("Creating AQUOS TV instance at %s:%s", url, ipport)
+        remote = await hass.async_add_executor_job(
+            partial(hub.tv, url, factory=AsyncIpTV, port=ipport,
+                    username=username, password=password, retries=retries,
+                    command_map=command_map or DEFAULT_COMMAND_MAP)
+        )
+    else:
+        url = config.get(CONF_PORT)
+        if url == AUTO_PORT:
+            found = await hass.async_add_executor_job(discover)
+            if not found:
+                _LOGGER.error("No Sharp Aquos TV found on the serial ports")
+                return
+            _LOGGER.info("Found %s", found[0])
+            url = found[0].port
+            if command_map is None:
+                command_map = found[0].region
+            if command_map is None:
+                _LOGGER.warning(
+                    "Cannot tell the region of the TV on %s, it matches the command maps %s."
+                    " Using %s, set %s to choose one",
+                    url,
+                    ", ".join(found[0].regions) or "none",
+                    DEFAULT_COMMAND_MAP,
+                    CONF_COMMAND_MAP,
+                )
+        command_map = command_map or DEFAULT_COMMAND_MAP
+        _LOGGER.debug("Creating AQUOS TV instance at %s", url)
+        remote = await hass.async_add_executor_job(
+            partial(hub.tv, url, retries=retries, command_map=command_map)
+        )
+    if config.get(CONF_DIAGNOSTICS):
+        hass.async_create_task(
+            async_load_platform(
+                hass, "sensor", DOMAIN, {CONF_NAME: name, CONF_PORT: url}, config
+            )
+        )
+
+    devices = await _async_get_devices(hass)
+    async_add_entities(
+        [SharpAquosTVDevice(name, remote, power_on_enabled, hub, devices.device(url))]
+    )
+
+    platform = entity_platform.async_get_current_platform()
+    platform.async_register_entity_service(
+        SERVICE_RUN_SCENE,
+        {vol.Required(ATTR_STEPS): vol.All(cv.ensure_list, [SCENE_STEP_SCHEMA])},
+        "async_run_scene",
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+
+def _catch_errors[_SharpAquosTVDeviceT: SharpAquosTVDevice, **_P](
+    func: Callable[Concatenate[_SharpAquosTVDeviceT, _P], Awaitable[Any]],
+) -> Callable[Concatenate[_SharpAquosTVDeviceT, _P], Coroutine[Any, Any, None]]:
+    """Log commands the TV did not answer, the TV client already retried them."""
+
+    async def wrapper(obj: _SharpAquosTVDeviceT, *args: _P.args, **kwargs: _P.kwargs) -> None:
+        """Wrap all command functions."""
+        try:
+            await func(obj, *args, **kwargs)
+        except (OSError, TypeError, ValueError) as error:
+            _LOGGER.warning("%s: %s failed: %s", obj.name, func.__name__, error)
 
     return wrapper
 
@@ -129,7 +259,8 @@ def _retry[_SharpAquosTVDeviceT: SharpAquosTVDevice, **_P](
 class SharpAquosTVDevice(MediaPlayerEntity):
     """Representation of a Aquos TV."""
 
-    _attr_source_list = list(SOURCES.values())
+    # Polls are scheduled by PollSchedule instead of the scan interval
+    _attr_should_poll = False
     _attr_supported_features = (
         MediaPlayerEntityFeature.TURN_OFF
         | MediaPlayerEntityFeature.NEXT_TRACK
@@ -143,7 +274,12 @@ class SharpAquosTVDevice(MediaPlayerEntity):
     )
 
     def __init__(
-        self, name: str, remote, power_on_enabled: bool = False
+        self,
+        name: str,
+        remote,
+        power_on_enabled: bool = False,
+        hub: AquosHub | None = None,
+        device: DeviceRecord | None = None,
     ) -> None:
         """Initialize the aquos device."""
         self._power_on_enabled = power_on_enabled
@@ -153,100 +289,245 @@ class SharpAquosTVDevice(MediaPlayerEntity):
         self._attr_name = name
         # Assume that the TV is not muted
         self._remote = remote
+        self._attr_source_list = remote.inputs.names()
+        self._poll_schedule = PollSchedule()
+        self._hub = hub
+        self._attr_extra_state_attributes = {}
+        self._device = device
+        self._validating = False
+        if device is not None:
+            remote.unsupported = device.unsupported
+            if device.info is not None:
+                # Known from an earlier start, without asking the TV
+                self._attr_unique_id = f"{device.model}_{device.url}"
+                self._attr_device_info = DeviceInfo(
+                    identifiers={(DOMAIN, self._attr_unique_id)},
+                    manufacturer="Sharp",
+                    model=device.model,
+                    name=device.info.get("name") or name,
+                    sw_version=device.info.get("version"),
+                )
 
     def set_state(self, state: MediaPlayerState) -> None:
         """Set TV state."""
         self._attr_state = state
 
-    @_retry
-    def update(self) -> None:
+    @property
+    def available(self) -> bool:
+        """Return False while the TV does not answer."""
+        return self._remote.available
+
+    async def async_added_to_hass(self) -> None:
+        """Start polling the TV."""
+        self._schedule_poll(0)
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Stop polling and release the serial port."""
+        if self._hub is None:
+            await self._remote.close()
+            return
+        self._hub.unschedule(self._async_poll)
+        await self._hub.release(self._remote)
+
+    def _schedule_poll(self, delay: float | None = None) -> None:
+        """Schedule the next poll with the hub, replacing a scheduled one."""
+        if self.hass is None or self._hub is None:
+            return
+        if delay is None:
+            delay = self._poll_schedule.delay()
+        self._hub.schedule(self._async_poll, delay)
+
+    async def _async_poll(self) -> float:
+        """Poll the TV, return the seconds until the next poll."""
+        await self.async_update()
+        self.async_write_ha_state()
+        return self._poll_schedule.delay()
+
+    def _command_sent(self) -> None:
+        """Show the effect of a command right away and poll sooner to verify it."""
+        self._apply_status(self._remote.state.snapshot())
+        if self.hass is not None:
+            self.async_write_ha_state()
+        self._poll_schedule.command_sent()
+        self._schedule_poll()
+
+    async def async_update(self) -> None:
         """Retrieve the latest data."""
-        if self._remote.power() == 1:
-            self._attr_state = MediaPlayerState.ON
-        else:
-            self._attr_state = MediaPlayerState.OFF
-        # Set TV to be able to remotely power on
-        if self._power_on_enabled:
-            self._remote.power_on_command_settings(2)
-        else:
-            self._remote.power_on_command_settings(0)
+        if self._remote.warming_up:
+            # Queries would wait for the TV to boot, keep the state set by turn_on
+            return
+        fields = self._poll_schedule.fields(input=self._remote.state.get("input"))
+        try:
+            status = await self._remote.status(fields, max_age=STATE_MAX_AGE)
+            # Set TV to be able to remotely power on
+            if self._power_on_enabled:
+                await self._remote.power_on_command_settings(2)
+            else:
+                await self._remote.power_on_command_settings(0)
+        except (OSError, TypeError, ValueError) as error:
+            # The state is kept, the entity is unavailable once the TV stops answering
+            _LOGGER.debug("%s: poll failed: %s", self.name, error)
+            self._poll_schedule.poll_failed()
+            return
+        self._poll_schedule.poll_succeeded(status.power == 1, fields)
+        self._apply_status(status)
+        if self._device is not None and status.power == 1:
+            self._record_capabilities(fields, status)
+
+    def _record_capabilities(self, fields: tuple[str, ...], status: Status) -> None:
+        """Remember fields the TV refuses, and check the cached info once it is on."""
+        device = self._device
+        for field in fields:
+            value = getattr(status, field)
+            if field == "power" or value is None or field in device.unsupported:
+                continue
+            if value is False:
+                if device.refused(field, self._attr_source):
+                    _LOGGER.info("%s: %s is not supported, not polling it", self.name, field)
+                    self._remote.unsupported = device.unsupported
+            else:
+                device.answered(field)
+        if not device.validated and not self._validating and self.hass is not None:
+            self._validating = True
+            self.hass.async_create_task(self._async_validate_device())
+
+    async def _async_validate_device(self) -> None:
+        """Query the info of the TV in the background and update the cache."""
+        try:
+            info = await self._remote.info()
+        except (OSError, TypeError, ValueError) as error:
+            _LOGGER.debug("%s: info query failed: %s", self.name, error)
+            return
+        finally:
+            self._validating = False
+        if self._device.update_info(info):
+            _LOGGER.debug("%s: stored %s", self.name, info)
+            self._remote.unsupported = self._device.unsupported
+
+    def _apply_status(self, status: Status) -> None:
+        """Set the entity attributes from the fields of status that are known."""
+        if status.power is not None:
+            if status.power == 1:
+                self._attr_state = MediaPlayerState.ON
+            else:
+                self._attr_state = MediaPlayerState.OFF
         # Get mute state
-        if self._remote.mute() == 2:
-            self._attr_is_volume_muted = False
-        else:
-            self._attr_is_volume_muted = True
+        if status.mute is not None:
+            self._attr_is_volume_muted = status.mute != 2
         # Get source
-        input = self._remote.input()
+        input = status.input
         if type(input) == int:
-            self._attr_source = SOURCES.get(input)
-        # Get volume
-        self._attr_volume_level = self._remote.volume() / 60
+            self._attr_source = self._remote.inputs.name(input)
+        # Get volume, unless a newer one is about to be written
+        if status.volume is not None and self._remote.pending_volume is None:
+            self._attr_volume_level = status.volume / 60
+        if status.power == 0:
+            self._attr_extra_state_attributes = {}
+        for key, value, names in (
+            ("av_mode", status.av_mode, AV_MODES),
+            ("view_mode", status.view_mode, VIEW_MODES),
+            ("surround", status.surround, SURROUND_MODES),
+            # Counts down in the state cache between queries
+            (
+                "sleep_minutes",
+                status.sleep if status.sleep is False else self._remote.state.get("sleep"),
+                {},
+            ),
+            ("analog_channel", status.analog_channel, {}),
+            ("digital_channel_air", status.digital_channel_air, {}),
+            ("digital_channel_cable", status.digital_channel_cable, {}),
+        ):
+            if value is False:
+                # Not reported by this TV, or not for the current input
+                self._attr_extra_state_attributes.pop(key, None)
+            elif value is not None:
+                self._attr_extra_state_attributes[key] = names.get(value, value)
+        if type(input) == int and input != 0:
+            # The channel is only reported while the TV input is selected
+            for key in TV_INPUT_FIELDS:
+                self._attr_extra_state_attributes.pop(key, None)
         _LOGGER.debug("state: {}, input: {} source: {}".format(self._attr_state, type(input), self._attr_source))
 
-    @_retry
-    def turn_off(self) -> None:
+    @_catch_errors
+    async def async_turn_off(self) -> None:
         """Turn off tvplayer."""
-        self._remote.power(0)
+        await self._remote.power(0)
+        self._command_sent()
+
+    def _queue_volume(self, volume: int | None = None, step: int = 0) -> None:
+        """Queue a volume change and show it right away."""
+        target = self._remote.queue_volume(volume, step)
+        if target is None:
+            _LOGGER.debug("Unknown volume, ignoring volume step")
+            return
+        self._attr_volume_level = target / 60
+        self._command_sent()
 
-    @_retry
-    def volume_up(self) -> None:
+    async def async_volume_up(self) -> None:
         """Volume up the media player."""
-        if self.volume_level is None:
-            _LOGGER.debug("Unknown volume in volume_up")
-            return
-        self._remote.volume(int(self.volume_level * 60) + 2)
+        self._queue_volume(step=2)
 
-    @_retry
-    def volume_down(self) -> None:
+    async def async_volume_down(self) -> None:
         """Volume down media player."""
-        if self.volume_level is None:
-            _LOGGER.debug("Unknown volume in volume_down")
-            return
-        self._remote.volume(int(self.volume_level * 60) - 2)
+        self._queue_volume(step=-2)
 
-    @_retry
-    def set_volume_level(self, volume: float) -> None:
+    async def async_set_volume_level(self, volume: float) -> None:
         """Set Volume media player."""
-        self._remote.volume(int(volume * 60))
+        self._queue_volume(int(volume * 60))
 
-    @_retry
-    def mute_volume(self, mute: bool) -> None:
+    @_catch_errors
+    async def async_mute_volume(self, mute: bool) -> None:
         """Send mute command."""
-        self._remote.mute(0)
+        await self._remote.mute(0)
+        self._command_sent()
 
-    @_retry
-    def turn_on(self) -> None:
+    @_catch_errors
+    async def async_turn_on(self) -> None:
         """Turn the media player on."""
-        self._remote.power(1)
-
-    @_retry
-    def media_play_pause(self) -> None:
+        await self._remote.power(1)
+        self._command_sent()
+
+    async def async_run_scene(self, steps: list[dict[str, Any]]) -> ServiceResponse:
+        """Run the steps of a scene as one batch, polls wait until it finished."""
+        try:
+            results = await self._remote.run_scene(steps)
+        except (OSError, ValueError) as error:
+            raise HomeAssistantError(f"{self.name}: scene failed: {error}") from error
+        self._command_sent()
+        response: dict[str, Any] = {"results": results}
+        for step, result in enumerate(results):
+            if isinstance(result, OSError):
+                results[step] = None
+                response["error"] = {"step": step, "message": str(result)}
+        return response
+
+    @_catch_errors
+    async def async_media_play_pause(self) -> None:
         """Simulate play pause media player."""
-        self._remote.remote_button(40)
+        await self._remote.remote_button("enter")
 
-    @_retry
-    def media_play(self) -> None:
+    @_catch_errors
+    async def async_media_play(self) -> None:
         """Send play command."""
-        self._remote.remote_button(16)
+        await self._remote.remote_button("play")
 
-    @_retry
-    def media_pause(self) -> None:
+    @_catch_errors
+    async def async_media_pause(self) -> None:
         """Send pause command."""
-        self._remote.remote_button(16)
+        await self._remote.remote_button("play")
 
-    @_retry
-    def media_next_track(self) -> None:
+    @_catch_errors
+    async def async_media_next_track(self) -> None:
         """Send next track command."""
-        self._remote.remote_button(21)
+        await self._remote.remote_button("skip_forward")
 
-    @_retry
-    def media_previous_track(self) -> None:
+    @_catch_errors
+    async def async_media_previous_track(self) -> None:
         """Send the previous track command."""
-        self._remote.remote_button(19)
+        await self._remote.remote_button("skip_back")
 
-    @_retry
-    def select_source(self, source: str) -> None:
+    @_catch_errors
+    async def async_select_source(self, source: str) -> None:
         """Set the input source."""
-        for key, value in SOURCES.items():
-            if source == value:
-                self._remote.input(key)
+        if await self._remote.input(source):
+            self._command_sent()
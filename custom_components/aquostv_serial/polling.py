@@ -0,0 +1,108 @@
+"""Adaptive polling of a Sharp Aquos TV."""
+import time
+
+from .tv import Status
+
+# Seconds between queries of each Status field while the TV is on.
+# Power is queried on every poll, fields the remote control changes
+# often, picture and sound modes and the channel rarely. The sleep timer
+# counts down in the state cache, it is only queried to correct the estimate.
+FIELD_INTERVALS = {
+    'power': 0,
+    'mute': 20,
+    'input': 20,
+    'volume': 20,
+    'av_mode': 300,
+    'view_mode': 300,
+    'surround': 300,
+    'sleep': 900,
+    'analog_channel': 300,
+    'digital_channel_air': 300,
+    'digital_channel_cable': 300,
+}
+
+# Fields only queried while the TV input (index 0) is selected
+TV_INPUT_FIELDS = ('analog_channel', 'digital_channel_air', 'digital_channel_cable')
+
+# Fields queried on every poll for fast_period seconds after a command
+FAST_FIELDS = ('power', 'mute', 'input', 'volume')
+
+
+class PollSchedule(object):
+    """
+    Description:
+        Decides when to poll a TV and which Status fields to query
+
+        While the TV is off only its power state is polled.
+        While it is on, each field is queried once its interval
+        in field_intervals passed, see FIELD_INTERVALS.
+        The channel is only queried while the TV input is selected.
+        For fast_period seconds after a command the TV is polled
+        every fast_interval seconds, so the new state shows up quickly.
+        After failed polls the interval doubles up to max_interval.
+
+        Times are seconds of time.monotonic().
+    """
+
+    def __init__(self, interval=10, fast_interval=1, fast_period=5, max_interval=300,
+                 field_intervals=FIELD_INTERVALS):
+        self.interval = interval
+        self.fast_interval = fast_interval
+        self.fast_period = fast_period
+        self.max_interval = max_interval
+        self.field_intervals = field_intervals
+        self._power_on = None
+        self._failures = 0
+        self._fast_until = 0
+        self._polled = {}
+
+    def fields(self, now=None, input=None):
+        """Return the Status fields the next poll should query, given the known input index."""
+        if self._power_on is False and self._failures == 0:
+            return ('power',)
+        if now is None:
+            now = time.monotonic()
+        fast = now < self._fast_until
+        # A poll a little early still counts, polls are not exactly on time
+        slack = self.interval / 2
+        tuner = input == 0 and input is not False
+        return tuple(field for field in Status._fields
+                     if (tuner or field not in TV_INPUT_FIELDS)
+                     and ((fast and field in FAST_FIELDS)
+                          or field not in self._polled
+                          or now - self._polled[field] >= self.field_intervals[field] - slack))
+
+    def delay(self, now=None):
+        """Return the seconds to wait before the next poll."""
+        if now is None:
+            now = time.monotonic()
+        if self._failures:
+            return min(self.interval * 2 ** self._failures, self.max_interval)
+        if now < self._fast_until:
+            return self.fast_interval
+        return self.interval
+
+    def command_sent(self, now=None):
+        """Record a command the TV accepted."""
+        if now is None:
+            now = time.monotonic()
+        self._failures = 0
+        self._fast_until = now + self.fast_period
+
+    def poll_succeeded(self, power_on, fields=(), now=None):
+        """Record a poll of fields answered by the TV, with the power state it reported."""
+        if now is None:
+            now = time.monotonic()
+        self._failures = 0
+        if power_on is not self._power_on:
+            # Nothing is known about a TV that was just switched on
+            self._polled.clear()
+        self._power_on = power_on
+        if power_on:
+            for field in fields:
+                self._polled[field] = now
+
+    def poll_failed(self):
+        """Record a poll the TV did not answer."""
+        self._failures += 1
+        self._power_on = None
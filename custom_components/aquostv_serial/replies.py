@@ -0,0 +1,105 @@
+"""Replies of a Sharp Aquos TV."""
+
+
+class UnexpectedReplyError(IOError):
+    """A reply that cannot be the answer to the command it was read for."""
+
+
+class Reply(object):
+    """
+    Description:
+        Base class of parsed replies
+
+        raw: the reply frame as received
+        value: the reply as returned by the TV command methods
+    """
+    __slots__ = ('raw',)
+    is_ok = False
+    is_error = False
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.raw)
+
+
+class StatusReply(Reply):
+    """
+    Description:
+        "OK" or "ERR", only the OK and ERR singletons exist
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, raw, value):
+        super().__init__(raw)
+        self.value = value
+
+    @property
+    def is_ok(self):
+        return self.value
+
+    @property
+    def is_error(self):
+        return not self.value
+
+
+OK = StatusReply(b'OK\r', True)
+ERR = StatusReply(b'ERR\r', False)
+
+
+class NumberReply(Reply):
+    """
+    Description:
+        A numeric value, e.g. the volume
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, raw, value):
+        super().__init__(raw)
+        self.value = value
+
+
+class TextReply(Reply):
+    """
+    Description:
+        Any other value, e.g. the name of the TV,
+        decoded only when value is read
+    """
+    __slots__ = ()
+
+    @property
+    def value(self):
+        return self.raw.strip().decode('utf-8', 'replace')
+
+
+_STATUS = {b'OK': OK, b'ERR': ERR}
+# Frames as the TV sends them are looked up without stripping them
+_STATUS.update({reply.raw: reply for reply in (OK, ERR)})
+
+
+def parse_reply(frame):
+    """
+    Description:
+
+        Classify a reply frame, bytes, bytearray or memoryview,
+        by exact match against "OK", "ERR" and numbers.
+        OK and ERR are returned as singletons,
+        numbers are converted without decoding the frame.
+
+    Returns:
+        OK, ERR, a NumberReply or a TextReply
+    """
+    if type(frame) is not bytes:
+        frame = bytes(frame)
+    reply = _STATUS.get(frame)
+    if reply is not None:
+        return reply
+    body = frame.strip()
+    reply = _STATUS.get(body)
+    if reply is not None:
+        return reply
+    digits = body[1:] if body[:1] == b'-' else body
+    if digits.isdigit():
+        return NumberReply(frame, int(body))
+    return TextReply(frame)
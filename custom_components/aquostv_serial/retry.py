@@ -0,0 +1,141 @@
+"""Retries, circuit breaking and power-on warm up for commands sent to a Sharp Aquos TV."""
+import random
+import time
+
+
+class UnavailableError(IOError):
+    """The TV stopped answering and is not probed again yet."""
+
+
+class RetryPolicy(object):
+    """
+    Description:
+        How often and how fast an exchange is retried
+
+        retries: attempts after the first one
+        delay: seconds before the first retry, doubled for each further retry
+        max_delay: upper bound of the delay
+        jitter: fraction by which each delay is randomly varied
+    """
+
+    def __init__(self, retries=2, delay=0.1, max_delay=1.0, jitter=0.2):
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def backoff(self, attempt):
+        """Return the seconds to wait before retry number attempt, from 0."""
+        delay = min(self.delay * 2 ** attempt, self.max_delay)
+        return delay * (1 + self.jitter * random.uniform(-1, 1))
+
+
+class CircuitBreaker(object):
+    """
+    Description:
+        Stops sending to a TV that does not answer
+
+        The breaker opens after threshold consecutive failed exchanges.
+        While it is open, commands fail at once with UnavailableError,
+        except for one cheap probe every probe_interval seconds.
+        It closes again when a probe is answered.
+
+        Times are seconds of time.monotonic().
+    """
+
+    def __init__(self, threshold=3, probe_interval=30):
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self._failures = 0
+        self._next_probe = None
+
+    @property
+    def is_open(self):
+        return self._next_probe is not None
+
+    def probe_due(self, now=None):
+        """Return True if the open breaker may send a probe."""
+        if now is None:
+            now = time.monotonic()
+        return now >= self._next_probe
+
+    def record_success(self):
+        self._failures = 0
+        self._next_probe = None
+
+    def record_failure(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        self._failures += 1
+        if self._failures >= self.threshold:
+            self._next_probe = now + self.probe_interval
+
+
+class ReopenBackoff(object):
+    """
+    Description:
+        Spaces out attempts to reopen a connection
+
+        The first attempt after a connection was lost is made at once.
+        Each failed attempt doubles the wait before the next one,
+        starting at delay seconds, up to max_delay.
+
+        Times are seconds of time.monotonic().
+    """
+
+    def __init__(self, delay=1.0, max_delay=60.0):
+        self.policy = RetryPolicy(delay=delay, max_delay=max_delay)
+        self._failures = 0
+        self._next_attempt = 0
+
+    def wait(self, now=None):
+        """Return the seconds until the next attempt is due, 0 if it is."""
+        if now is None:
+            now = time.monotonic()
+        return max(0, self._next_attempt - now)
+
+    def record_success(self):
+        self._failures = 0
+        self._next_attempt = 0
+
+    def record_failure(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        self._next_attempt = now + self.policy.backoff(self._failures)
+        self._failures += 1
+
+
+class WarmUp(object):
+    """
+    Description:
+        Tracks a TV booting after it was switched on
+
+        While the TV boots, commands are held back. The TV is probed
+        every probe_interval seconds, waiting probe_timeout seconds
+        for a reply, until it reports power on or max_time passed.
+
+        Times are seconds of time.monotonic().
+    """
+
+    def __init__(self, probe_interval=0.5, probe_timeout=0.3, max_time=30):
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.max_time = max_time
+        self._until = None
+
+    @property
+    def active(self):
+        return self._until is not None
+
+    def start(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        self._until = now + self.max_time
+
+    def expired(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return self._until is not None and now >= self._until
+
+    def finish(self):
+        self._until = None
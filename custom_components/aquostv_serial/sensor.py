@@ -0,0 +1,135 @@
+"""Diagnostic sensors of the connection to a Sharp Aquos TV."""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from homeassistant.components.sensor import (
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.const import (
+    CONF_NAME,
+    CONF_PORT,
+    EntityCategory,
+    UnitOfInformation,
+    UnitOfTime,
+)
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
+
+from .media_player import DOMAIN
+from .stats import CommandStats
+
+
+def _milliseconds(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+@dataclass(frozen=True, kw_only=True)
+class AquosSensorEntityDescription(SensorEntityDescription):
+    """Describes a sensor reading the CommandStats of a TV."""
+
+    value_fn: Callable[[CommandStats], float | int | None]
+
+
+SENSORS: tuple[AquosSensorEntityDescription, ...] = (
+    AquosSensorEntityDescription(
+        key="latency_p95",
+        name="command latency p95",
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda stats: _milliseconds(stats.total_latency().quantile(0.95)),
+    ),
+    AquosSensorEntityDescription(
+        key="queue_wait_p95",
+        name="queue wait p95",
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda stats: _milliseconds(stats.queue_wait.quantile(0.95)),
+    ),
+    AquosSensorEntityDescription(
+        key="timeouts",
+        name="timeouts",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda stats: stats.timeouts,
+    ),
+    AquosSensorEntityDescription(
+        key="errors",
+        name="ERR replies",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda stats: stats.errors,
+    ),
+    AquosSensorEntityDescription(
+        key="retries",
+        name="retries",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda stats: stats.retries,
+    ),
+    AquosSensorEntityDescription(
+        key="bytes_sent",
+        name="bytes sent",
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda stats: stats.bytes_sent,
+    ),
+    AquosSensorEntityDescription(
+        key="bytes_received",
+        name="bytes received",
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda stats: stats.bytes_received,
+    ),
+)
+
+
+async def async_setup_platform(
+    hass: HomeAssistant,
+    config: ConfigType,
+    async_add_entities: AddEntitiesCallback,
+    discovery_info: DiscoveryInfoType | None = None,
+) -> None:
+    """Set up the diagnostic sensors of a TV set up by the media_player platform."""
+    if discovery_info is None:
+        return
+    remote = hass.data[DOMAIN].get(discovery_info[CONF_PORT])
+    if remote is None:
+        return
+    name = discovery_info[CONF_NAME]
+    async_add_entities(
+        AquosStatsSensor(name, remote.stats, description) for description in SENSORS
+    )
+
+
+class AquosStatsSensor(SensorEntity):
+    """A statistic of the commands sent to a TV."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    entity_description: AquosSensorEntityDescription
+
+    def __init__(
+        self, name: str, stats: CommandStats, description: AquosSensorEntityDescription
+    ) -> None:
+        """Initialize the sensor."""
+        self.entity_description = description
+        self._attr_name = f"{name} {description.name}"
+        self._stats = stats
+
+    @property
+    def native_value(self) -> float | int | None:
+        """Return the statistic."""
+        return self.entity_description.value_fn(self._stats)
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        """Return the latency of each command for the latency sensor."""
+        if self.entity_description.key != "latency_p95":
+            return None
+        return {
+            command: _milliseconds(histogram.quantile(0.95))
+            for command, histogram in self._stats.latency.items()
+        }
@@ -0,0 +1,110 @@
+"""Counters and latency histograms of the commands sent to a TV."""
+import bisect
+
+# Upper bounds of the histogram buckets in seconds, the last bucket is unbounded
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram(object):
+    """
+    Description:
+        Distribution of durations in fixed BUCKETS
+
+        Quantiles are estimated as the upper bound of the bucket
+        they fall in, the maximum for the unbounded bucket.
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, fraction):
+        """Return the estimated duration below which fraction of them are, or None."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {'count': self.count,
+                'mean': self.mean,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'max': self.max,
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['inf'], self.counts))}
+
+
+class CommandStats(object):
+    """
+    Description:
+        Statistics of the exchanges of one TV
+
+        latency: Histogram per command, e.g. "POWR",
+            from writing the command to receiving its reply
+        queue_wait: Histogram of the time exchanges waited
+            for the port before being sent
+        bytes_sent, bytes_received: bytes written and read
+        timeouts: replies that did not arrive in time
+        errors: "ERR" replies
+        retries: exchanges sent again after a failure
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.latency = {}
+        self.queue_wait = Histogram()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.retries = 0
+
+    def add_reply(self, frame, reply, seconds):
+        """Record the reply to one command frame and its latency."""
+        command = frame[:4].decode('ascii', 'replace')
+        histogram = self.latency.get(command)
+        if histogram is None:
+            histogram = self.latency[command] = Histogram()
+        histogram.add(seconds)
+        self.bytes_received += len(reply)
+
+    def total_latency(self):
+        """Return a Histogram of the latency of all commands."""
+        total = Histogram()
+        for histogram in self.latency.values():
+            total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+            total.count += histogram.count
+            total.total += histogram.total
+            total.max = max(total.max, histogram.max)
+        return total
+
+    def as_dict(self):
+        return {'latency': {command: histogram.as_dict()
+                            for command, histogram in self.latency.items()},
+                'queue_wait': self.queue_wait.as_dict(),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'retries': self.retries}
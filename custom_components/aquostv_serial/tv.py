@@ -1,10 +1,93 @@
 """Module to control a Sharp Aquos Remote Control enabled TV."""
-import yaml
-import serial
+import collections
 import logging
+import threading
+import time
+
+from .commands import VALID_COMMAND_MAPS, get_command_map
+from .connection import (EIGHTBITS, IP_PORT, PARITY_NONE, STOPBITS_ONE,
+                         SerialConnection, TcpConnection)
+from .replies import NumberReply, UnexpectedReplyError, parse_reply
+from .retry import CircuitBreaker, RetryPolicy, UnavailableError, WarmUp
+from .stats import CommandStats
 
 _LOGGER = logging.getLogger(__name__)
 
+Status = collections.namedtuple(
+    'Status', ['power', 'mute', 'input', 'volume',
+               'av_mode', 'view_mode', 'surround', 'sleep',
+               'analog_channel', 'digital_channel_air', 'digital_channel_cable'],
+    defaults=(None,) * 7)
+Status.__doc__ = """
+    Description:
+        Snapshot of the state polled by TV.status()
+
+        power: 0 or 1, mute: 1 or 2,
+        input: input index, volume: 0 - 100,
+        av_mode, view_mode, surround: see TV.av_mode(),
+        TV.view_mode() and TV.surround(),
+        sleep: minutes until the sleep timer switches the TV off, 0 if unset
+        analog_channel, digital_channel_air, digital_channel_cable:
+            channel as reported by the TV, see TV.analog_channel(),
+            only reported while the TV input is selected
+        Values the TV refused to report are False,
+        fields that were not queried are None
+"""
+
+
+class StateCache(object):
+    """
+    Description:
+        Last known value of each Status field
+        and the time it was learned
+
+        Values come from query replies and from set commands
+        the TV acknowledged with OK. A field is forgotten
+        when the TV refuses to report it or its value is unknown
+        after a command, e.g. after a volume step.
+
+        The sleep timer counts down from the minutes learned,
+        so it stays correct without querying it again.
+
+        Times are seconds of time.monotonic().
+    """
+    __slots__ = ('_values',)
+    _COUNTDOWN_FIELDS = ('sleep',)
+
+    def __init__(self):
+        self._values = {}
+
+    def get(self, field, max_age=None, now=None):
+        """Return the value of field, or None if unknown or older than max_age seconds."""
+        entry = self._values.get(field)
+        if entry is None:
+            return None
+        value, learned = entry
+        if now is None:
+            now = time.monotonic()
+        if max_age is not None and now - learned > max_age:
+            return None
+        if field in self._COUNTDOWN_FIELDS and value:
+            value = max(0, value - int((now - learned) // 60))
+        return value
+
+    def set(self, field, value, now=None):
+        if now is None:
+            now = time.monotonic()
+        self._values[field] = (int(value), now)
+
+    def forget(self, *fields):
+        """Forget fields, or every field when called without arguments."""
+        if not fields:
+            self._values.clear()
+        for field in fields:
+            self._values.pop(field, None)
+
+    def snapshot(self, max_age=None):
+        """Return the known values as Status, unknown fields are None."""
+        now = time.monotonic()
+        return Status(*(self.get(field, max_age, now) for field in Status._fields))
+
 
 class TV(object):
     """
@@ -16,44 +99,72 @@ class TV(object):
     Author: Jeffrey Moore <jmoore987@yahoo.com>
 
     URL: http://github.com/jmoore/sharp_aquos_rc
+
+    Exchanges the TV does not answer are retried according to
+    retry_policy. After repeated failures circuit_breaker makes
+    commands fail at once with UnavailableError,
+    until a probe shows the TV answers again.
+
+    stats records the latency, errors and retries of the exchanges.
+
+    Status fields in unsupported are not queried by status(),
+    they are reported as refused, see DeviceRecord.
+
+    After power(1) switched the TV on, commands are held
+    until it finished booting, see warm_up.
     """
-    _VALID_COMMAND_MAPS = ["eu", "us", "cn", "jp"]
+    _VALID_COMMAND_MAPS = VALID_COMMAND_MAPS
+    # Settings stored by the TV which only need to be written once
+    _WRITE_ONCE_SETTINGS = ["power_control"]
 
-    def __init__(self, url, baudrate=9600, stopbits=serial.STOPBITS_ONE,
-                 bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE,
-                 timeout=2, write_timeout=2, command_map='us'):
+    def __init__(self, url, baudrate=9600, stopbits=STOPBITS_ONE,
+                 bytesize=EIGHTBITS, parity=PARITY_NONE,
+                 timeout=2, write_timeout=2, command_map='us', retries=2):
         """
         Initialize the client.
         """
-        self._port = serial.serial_for_url(url, do_not_open=True)
-        self._port.baudrate = baudrate
-        self._port.stopbits = stopbits
-        self._port.bytesize = bytesize
-        self._port.parity = parity
-        self._port.timeout = timeout
-        self._port.write_timeout = write_timeout
-        self._port.open()
-        if command_map not in self._VALID_COMMAND_MAPS:
-            raise ValueError("command_layout should be one of %s, not %s" % (str(self._VALID_COMMAND_MAPS), command_map))
-
-        # To access files from imported package:
-        #   import pkgutil
-        #   stream = pkgutil.get_data("sharp_aquos_rc", "commands/%s.yaml" % command_map)
-        # To access files when hass object is available:
-        #   yamlpath = hass.config.path('custom_components', 'aquostv_serial', 'commands')
-        #   stream = open(os.path.join(yamlpath, f'{command_map}.yaml'))
-        # Use direct path access for now
-        stream = open('/config/custom_components/aquostv_serial/commands/{}.yaml'.format(command_map))
-        self.command = yaml.load(stream, Loader=yaml.FullLoader)
+        self._connection = SerialConnection(
+            url, baudrate=baudrate, stopbits=stopbits, bytesize=bytesize,
+            parity=parity, timeout=timeout, write_timeout=write_timeout)
+        self._init_client(command_map, retries)
+
+    def _init_client(self, command_map, retries):
+        self._lock = threading.RLock()
+        self.retry_policy = RetryPolicy(retries)
+        self.circuit_breaker = CircuitBreaker()
+        self.stats = CommandStats()
+        self.warm_up = WarmUp()
+        self.unsupported = frozenset()
+        self._open_count = self._connection.open_count
+        self._load_command_map(command_map)
+
+    def _load_command_map(self, command_map):
+        # Shared by all instances using the same map, do not modify
+        command_map = get_command_map(command_map)
+        self.command = command_map.command
+        self._commands = command_map.commands
+        self.inputs = command_map.inputs
+        self.remote_keys = command_map.remote
+        self._reply_values = {self._commands.frame(*self._query_command(key)): values
+                              for key, values in self._REPLY_VALUES.items()
+                              if key in self._commands}
+        self._settings = {}
+        self.state = StateCache()
+
+    # Values a query may be answered with besides ERR, None for any number.
+    # Any other reply belongs to another command.
+    _REPLY_VALUES = {'power': (0, 1), 'mute': (1, 2), 'volume': range(101),
+                     'input_index': None, 'av_mode': None, 'view_mode': None,
+                     'sound_mode': None, 'sleep': None, 'analog_channel': None,
+                     'digital_channel_air': None, 'digital_channel_cable_major': None}
 
     def _send_command_raw(self, command, opt=''):
         """
         Description:
 
-            The TV doesn't handle long running connections very well,
-            so we open a new connection every time.
-            There might be a better way to do this,
-            but it's pretty quick and resilient.
+            Send a command given by its protocol name, e.g. "POWR",
+            with its parameter. The port stays open between commands,
+            see SerialConnection.
 
         Returns:
             If a value is being requested ( opt2 is "?" ),
@@ -61,6 +172,27 @@ class TV(object):
             If a value is being set,
             it returns True for "OK" or False for "ERR"
         """
+        return self._send_frames([self._encode_command(command, opt)])[0]
+
+    def _send_frames(self, frames, interval=0, queries=False):
+        """
+        Description:
+
+            Write all frames back to back,
+            then collect one reply per frame in the same order
+
+        Arguments:
+            frames: list of wire frames
+            interval: seconds to wait between writing two frames
+            queries: True if every frame only reads a setting,
+                so the frames can be sent again one by one
+                when a reply is missing
+
+        Returns:
+            list of replies, see _send_command_raw
+
+        Exchanges from different threads do not interleave.
+        """
         # According to the documentation:
         # http://files.sharpusa.com/Downloads/ForHome/
         # HomeEntertainment/LCDTVs/Manuals/tel_man_LC40_46_52_60LE830U.pdf
@@ -69,58 +201,506 @@ class TV(object):
         # so we need to the remote commands to be sure about states
         # clear
 
-        self._port.reset_output_buffer()
-        self._port.reset_input_buffer()
-        # Send command
-        if opt != '':
-            command += str(opt)
-        command = command.ljust(8)+'\r\n'
-        command = command.encode('utf-8')
-        _LOGGER.debug('*Sending "%s"', command)
-        self._port.write(command)
-        self._port.flush()
-        # receive
-        result = bytearray()
+        queued = time.perf_counter()
+        with self._lock:
+            self.stats.queue_wait.add(time.perf_counter() - queued)
+            if self.warm_up.active:
+                self._wait_until_ready()
+            if self.circuit_breaker.is_open:
+                self._probe()
+            if len(frames) > 1:
+                results = []
+                try:
+                    self._exchange(frames, results, interval)
+                except OSError:
+                    # Replies carry no reference to their command. After a
+                    # missing reply the ones read may belong to later frames,
+                    # so go on with one frame at a time. Frames changing
+                    # the TV may have been executed, they are not sent twice.
+                    if not queries:
+                        self.circuit_breaker.record_failure()
+                        raise
+                    self.stats.retries += 1
+                else:
+                    self.circuit_breaker.record_success()
+                    return results
+            return [self._send_frame(frame) for frame in frames]
+
+    def _send_frame(self, frame):
+        """Send one frame, retrying as the retry policy allows."""
+        attempt = 0
         while True:
-            char = self._port.read(1)
-            if char is None:
+            results = []
+            try:
+                self._exchange([frame], results)
+            except OSError:
+                if attempt >= self.retry_policy.retries:
+                    self.circuit_breaker.record_failure()
+                    raise
+                time.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+                self.stats.retries += 1
+            else:
+                self.circuit_breaker.record_success()
+                return results[0]
+
+    @property
+    def available(self):
+        """False while the TV is not answering."""
+        return not self.circuit_breaker.is_open
+
+    def _probe(self):
+        if not self.circuit_breaker.probe_due():
+            raise UnavailableError('TV is not answering')
+        try:
+            self._exchange([self._commands.frame('power', '?')], [])
+        except OSError as error:
+            self.circuit_breaker.record_failure()
+            raise UnavailableError('TV is still not answering') from error
+        self.circuit_breaker.record_success()
+        # The TV may have been reset while it was not answering
+        self._settings.clear()
+
+    @property
+    def warming_up(self):
+        """True while commands are held for the TV to boot."""
+        return self.warm_up.active
+
+    def _wait_until_ready(self):
+        """Probe the booting TV with POWR? until it reports power on."""
+        frame = self._commands.frame('power', '?')
+        while self.warm_up.active:
+            if self.warm_up.expired():
+                _LOGGER.warning('TV did not answer within %s s after power on',
+                                self.warm_up.max_time)
                 break
-            if not char:
-                raise serial.SerialTimeoutException(
-                    'Connection timed out! Last received bytes {}'
-                    .format([hex(a) for a in result]))
-            result += char
-            if result and result[-1:] == b'\r':
+            started = time.monotonic()
+            try:
+                # Late replies to earlier probes answer the same query
+                self._connection.discard_input(wait=False)
+                self._connection.write(frame)
+                result = self._parse_reply(
+                    self._connection.read_frame(self.warm_up.probe_timeout))
+            except OSError as error:
+                import serial
+                if not isinstance(error, serial.SerialTimeoutException):
+                    self.warm_up.finish()
+                    raise
+                result = None
+            if self._is_ready(result):
                 break
-        status = bytes(result).strip().decode("utf-8")
-        _LOGGER.debug('*Received "%s"', status)
-
-        if "OK" in status:
-            return True
-        if "ERR" in status:
-            return False
+            time.sleep(max(0, self.warm_up.probe_interval - (time.monotonic() - started)))
+        self.warm_up.finish()
+
+    @staticmethod
+    def _is_ready(result):
+        # Booting TVs do not answer, or answer ERR or 0
+        return result == 1 and result is not True
+
+    def _exchange(self, frames, results, interval=0):
+        """Write frames and append their replies to results as they arrive."""
+        data = b''.join(frames)
+        _LOGGER.debug('*Sending "%s"', data)
         try:
-            return int(status)
-        except ValueError:
-            return status
+            self._connection.discard_input()
+            self._check_reopened()
+            if interval:
+                # Replies to the frames written so far wait in the input buffer
+                for frame in frames[:-1]:
+                    self._connection.write(frame)
+                    time.sleep(interval)
+                self._connection.write(frames[-1])
+            else:
+                self._connection.write(data)
+            self.stats.bytes_sent += len(data)
+            sent = time.perf_counter()
+            for frame in frames:
+                results.append(self._parse_tracked(frame, self._connection.read_frame(), sent))
+        except UnexpectedReplyError:
+            # The reply to the frame is still to come
+            self._connection.skip_reply()
+            raise
+        except OSError as error:
+            self._count_timeout(error)
+            raise
+
+    def _check_reopened(self):
+        # The TV may have been reset while the port was closed
+        if self._connection.open_count != self._open_count:
+            self._open_count = self._connection.open_count
+            self._settings.clear()
+
+    def _parse_tracked(self, frame, reply, sent):
+        self.stats.add_reply(frame, reply, time.perf_counter() - sent)
+        _LOGGER.debug('*Received %r', reply)
+        reply = parse_reply(reply)
+        if reply.is_error:
+            self.stats.errors += 1
+            return reply.value
+        if self._is_unexpected(frame, reply):
+            self.stats.errors += 1
+            raise UnexpectedReplyError('Unexpected reply {!r} to {!r}'.format(reply.raw, frame))
+        return reply.value
+
+    def _is_unexpected(self, frame, reply):
+        if frame not in self._reply_values:
+            return False
+        if not isinstance(reply, NumberReply):
+            return True
+        values = self._reply_values[frame]
+        return values is not None and reply.value not in values
+
+    def _count_timeout(self, error):
+        import serial
+        if isinstance(error, serial.SerialTimeoutException):
+            self.stats.timeouts += 1
 
-    def _check_command_name(self, name, dicitionary):
-        if name not in dicitionary:
-            raise ValueError(name + "command is not in list")
+    def _send_commands(self, commands):
+        """
+        Description:
+
+            Send commands from the command table in one exchange
+
+        Arguments:
+            commands: list of (name, opt) tuples
+
+        Returns:
+            list of replies, see _send_command_raw
+        """
+        results = self._send_frames([self._commands.frame(name, opt)
+                                     for name, opt in commands],
+                                    queries=self._all_queries(commands))
+        self._track_replies(commands, results)
+        return results
+
+    def _all_queries(self, commands):
+        return all(self._commands.is_query(name, opt) for name, opt in commands)
+
+    def run_scene(self, steps):
+        """
+        Description:
+
+            Run a sequence of commands while holding the port,
+            so no other command or poll is sent in between.
+            Commands without a delay between them
+            are sent in one pipelined exchange.
+            A power command ends its exchange, so after
+            switching the TV on the next steps wait until it booted.
+
+        Arguments:
+            steps: list of dicts with the keys
+                command: name in the command map, e.g. "av_mode",
+                    "input" or "remote" (optional)
+                value: parameter, an input or a remote key (optional)
+                delay: seconds to wait after the step (optional)
+                or (command, value) tuples
+
+        Returns:
+            list with the reply to each step, None for steps without command.
+            When an exchange fails, the scene stops: the entry of its
+            first step is the OSError raised, the later entries are None.
+        """
+        commands, delays = self._scene_plan(steps)
+        results = [None] * len(commands)
+        with self._lock:
+            for indexes, batch, delay in self._scene_batches(commands, delays):
+                if batch:
+                    try:
+                        replies = self._send_commands(batch)
+                    except OSError as error:
+                        self._scene_failed(results, indexes, error)
+                        break
+                    for index, result in zip(indexes, replies):
+                        results[index] = result
+                if delay:
+                    time.sleep(delay)
+        return results
+
+    @staticmethod
+    def _scene_failed(results, indexes, error):
+        # Replies carry no reference to their command,
+        # which one of the exchange went missing is not known
+        _LOGGER.warning('Scene stopped at step %s: %s', indexes[0], error)
+        results[indexes[0]] = error
+
+    def _scene_plan(self, steps):
+        commands = []
+        delays = []
+        for step in steps:
+            if not isinstance(step, dict):
+                step = {'command': step[0], 'value': step[1] if len(step) > 1 else ''}
+            name = step.get('command')
+            if name is None:
+                commands.append(None)
+            else:
+                commands.append(self._scene_command(name, step.get('value', '')))
+            delays.append(float(step.get('delay', 0)))
+        return commands, delays
+
+    def _scene_command(self, name, opt):
+        key = self._command_key(name)
+        if key == 'input':
+            input_key = self.inputs.key(opt)
+            if input_key is None:
+                raise ValueError("%s is not an input" % opt)
+            return 'input.%s.command' % input_key, ''
+        if key == 'remote':
+            name = self.remote_keys.name(opt)
+            if name is None:
+                raise ValueError("%s is not a remote key" % (opt,))
+            return 'remote.%s' % name, ''
+        # Nested commands are addressed by their value
+        nested = '%s.%s' % (key, opt)
+        if opt != '' and nested in self._commands:
+            return nested, ''
+        if key not in self._commands:
+            raise ValueError(key + " command is not in list")
+        return key, opt
+
+    @staticmethod
+    def _scene_batches(commands, delays):
+        """Yield (step indexes, commands, delay) for each exchange of a scene."""
+        indexes = []
+        batch = []
+        for index, (command, delay) in enumerate(zip(commands, delays)):
+            if command is not None:
+                indexes.append(index)
+                batch.append(command)
+            if delay or (command is not None and command[0] == 'power'):
+                yield indexes, batch, delay
+                indexes = []
+                batch = []
+        if batch:
+            yield indexes, batch, 0
+
+    def _track_replies(self, commands, results):
+        """
+        Description:
+
+            Remember the acknowledged value of write-once settings.
+            They are forgotten when the TV refuses them
+            or the power state changes.
+            Update the state cache from the replies.
+        """
+        for (name, opt), result in zip(commands, results):
+            if name == 'power':
+                if str(opt) == '1' and result is True and self.state.get('power') != 1:
+                    self.warm_up.start()
+                if opt != '?' or isinstance(result, bool) or result != self.state.get('power'):
+                    self._settings.clear()
+                    # Nothing else is reported while the TV is off
+                    self.state.forget()
+                if opt == '?':
+                    self._track_query('power', result)
+                elif result is True:
+                    self.state.set('power', opt)
+            elif name in self._WRITE_ONCE_SETTINGS:
+                if result is False:
+                    self._settings.pop(name, None)
+                elif opt == '?':
+                    self._settings[name] = result
+                elif result is True:
+                    self._settings[name] = opt
+            elif name == 'mute':
+                if opt == '?':
+                    self._track_query('mute', result)
+                elif result is True:
+                    self._track_mute(int(opt))
+            elif name == 'volume':
+                if opt == '?':
+                    self._track_query('volume', result)
+                elif result is True:
+                    self.state.set('volume', opt)
+            elif name in ('volume_up', 'volume_down'):
+                if result is True:
+                    self.state.forget('volume')
+            elif name in self._MODE_FIELDS:
+                field = self._MODE_FIELDS[name]
+                if opt == '?':
+                    self._track_query(field, result)
+                elif result is True and str(opt) != '0':
+                    self.state.set(field, opt)
+                elif result is True:
+                    # 0 toggles to a mode that depends on the model
+                    self.state.forget(field)
+            elif name == 'sleep':
+                if opt == '?':
+                    self._track_query('sleep', result)
+                elif result is True:
+                    self.state.set('sleep', self._SLEEP_MINUTES * int(opt))
+            elif name in self._CHANNEL_FIELDS:
+                if opt == '?':
+                    self._track_query(self._CHANNEL_FIELDS[name], result)
+                elif result is True:
+                    # Set and reported channels are encoded differently
+                    self.state.forget(*self._CHANNEL_FIELDS.values())
+            elif name in ('channel_up', 'channel_down'):
+                if result is True:
+                    self.state.forget(*self._CHANNEL_FIELDS.values())
+            elif name == 'input_index':
+                self._track_query('input', result)
+            elif name.startswith('input.') and name.endswith('.command'):
+                if result is True:
+                    self.state.set('input', self.inputs.index(name[len('input.'):-len('.command')]))
+
+    # Commands of the Status fields stored as the parameter they were set to
+    _MODE_FIELDS = {'av_mode': 'av_mode', 'view_mode': 'view_mode',
+                    'sound_mode': 'surround'}
+    # Commands of the Status fields of the tuned channel
+    _CHANNEL_FIELDS = {'analog_channel': 'analog_channel',
+                       'digital_channel_air': 'digital_channel_air',
+                       'digital_channel_cable_major': 'digital_channel_cable'}
+    # Minutes per step of the sleep() parameter
+    _SLEEP_MINUTES = 30
+
+    def _track_query(self, field, result):
+        if isinstance(result, int) and not isinstance(result, bool):
+            self.state.set(field, result)
+        else:
+            self.state.forget(field)
+
+    def _track_mute(self, opt):
+        if opt != 0:
+            self.state.set('mute', opt)
+            return
+        # 0 toggles between 1 (muted) and 2 (not muted)
+        mute = self.state.get('mute')
+        if mute in (1, 2):
+            self.state.set('mute', 3 - mute)
+        else:
+            self.state.forget('mute')
+
+    def _send_setting(self, name, opt='?'):
+        with self._lock:
+            self._check_reopened()
+            if opt != '?' and self._connection.is_open and \
+                    name in self._settings and self._settings[name] == opt:
+                return True
+            return self._send_command(name, opt)
+
+    def _cached(self, field, opt, max_age):
+        # Value of a Status field to answer a query with, or None
+        if opt != '?' or max_age is None:
+            return None
+        return self.state.get(field, max_age)
+
+    def _send_field(self, field, opt, max_age):
+        """Query or set a Status field, see power()."""
+        cached = self._cached(field, opt, max_age)
+        if cached is not None:
+            return cached
+        return self._send_command(self._STATUS_QUERIES[field], opt)
+
+    @staticmethod
+    def _encode_command(command, opt=''):
+        """
+        Description:
+
+            Build the wire frame for a command:
+            the command and its parameter padded to 8 characters
+
+        """
+        if opt != '':
+            command += str(opt)
+        command = command.ljust(8)+'\r\n'
+        return command.encode('utf-8')
+
+    @staticmethod
+    def _parse_reply(reply):
+        """
+        Description:
+
+            Convert a reply frame received from the TV
+
+        Returns:
+            True for "OK", False for "ERR",
+            otherwise the value as int or string
+        """
+        _LOGGER.debug('*Received %r', reply)
+        return parse_reply(reply).value
+
+    @staticmethod
+    def _command_key(name):
+        # ['input', 'hdmi_1', 'command'] is the same as 'input.hdmi_1.command'
+        if isinstance(name, list):
+            return '.'.join(str(val) for val in name)
+        return name
 
     def _send_command(self, name, parameter=''):
-        if isinstance(name, str):
-            self._check_command_name(name, self.command)
-            command = self.command[name]
-        elif isinstance(name, list):
-            dictionary = self.command
-            for val in name:
-                self._check_command_name(val, dictionary)
-                if isinstance(dictionary[val], dict):
-                    dictionary = dictionary[val]
-                else:
-                    command = dictionary[val]
-        return self._send_command_raw(command, parameter)
+        return self._send_commands([(self._command_key(name), parameter)])[0]
+
+    def query_many(self, names):
+        """
+        Description:
+
+            Query several settings in one exchange.
+            All queries are written at once and the replies
+            are read back in order, instead of waiting for
+            each reply before sending the next query.
+
+        Arguments:
+            names: list of command names, e.g. ['power', 'volume']
+
+        Returns:
+            list of values in the order of names
+        """
+        return self._send_commands([self._query_command(name)
+                                    for name in names])
+
+    def _query_command(self, name):
+        key = self._command_key(name)
+        return key, '?' if self._commands.has_parameter(key) else ''
+
+    # Commands queried by info(), named as in its result
+    _INFO_QUERIES = ('name', 'model', 'version', 'ip_version')
+
+    # Command queried for each Status field
+    _STATUS_QUERIES = {'power': 'power', 'mute': 'mute',
+                       'input': 'input_index', 'volume': 'volume',
+                       'av_mode': 'av_mode', 'view_mode': 'view_mode',
+                       'surround': 'sound_mode', 'sleep': 'sleep',
+                       'analog_channel': 'analog_channel',
+                       'digital_channel_air': 'digital_channel_air',
+                       'digital_channel_cable': 'digital_channel_cable_major'}
+
+    def _stale_fields(self, fields, max_age):
+        fields = [field for field in fields if field not in self.unsupported]
+        if max_age is None:
+            return tuple(fields)
+        now = time.monotonic()
+        if isinstance(max_age, dict):
+            return tuple(field for field in fields
+                         if self.state.get(field, max_age.get(field, 0), now) is None)
+        return tuple(field for field in fields
+                     if self.state.get(field, max_age, now) is None)
+
+    def _status_from_replies(self, fields, stale, replies):
+        values = dict.fromkeys(Status._fields)
+        for field in fields:
+            values[field] = False if field in self.unsupported else self.state.get(field)
+        values.update(zip(stale, replies))
+        if 'input' in stale:
+            values['input'] = self._input_from_index(values['input'])
+        return Status(**values)
+
+    def status(self, fields=Status._fields, max_age=None):
+        """
+        Description:
+
+            Returns a Status snapshot of the fields
+            queried in a single pipelined exchange
+
+        Arguments:
+            fields: Status fields to query, e.g. ('power',)
+            max_age: seconds, or dict of seconds per field (optional)
+                Fields the state cache learned within max_age
+                are taken from the cache instead of being queried
+        """
+        stale = self._stale_fields(fields, max_age)
+        replies = []
+        if stale:
+            replies = self.query_many([self._STATUS_QUERIES[field] for field in stale])
+        return self._status_from_replies(fields, stale, replies)
 
     def info(self):
         """
@@ -128,12 +708,10 @@ class TV(object):
 
             Returns dict of information about the TV
             name, model, version
+            queried in a single pipelined exchange
 
         """
-        return {"name": self._send_command('name'),
-                "model": self._send_command('model'),
-                "version": self._send_command('version'),
-                "ip_version": self._send_command('ip_version')}
+        return dict(zip(self._INFO_QUERIES, self.query_many(self._INFO_QUERIES)))
 
     def power_on_command_settings(self, opt='?'):
         """
@@ -147,10 +725,14 @@ class TV(object):
                 0: disabled
                 1: accepted via RS232
                 2: accepted via TCP/IP
+
+        Returns:
+            True without sending anything when the TV
+            already acknowledged the same setting
         """
-        return self._send_command('power_control', opt)
+        return self._send_setting('power_control', opt)
 
-    def power(self, opt='?'):
+    def power(self, opt='?', max_age=None):
         """
         Description:
 
@@ -161,8 +743,11 @@ class TV(object):
             opt: integer
                 0: Off
                 1: On
+            max_age: seconds (optional)
+                A query is answered by the state cache
+                when it learned the value within max_age
         """
-        return self._send_command('power', opt)
+        return self._send_field('power', opt, max_age)
 
     def get_input_list(self):
         """
@@ -172,12 +757,9 @@ class TV(object):
             Returns an dict of all available input keys and names
 
         """
-        inputs = {}
-        for key in self.command['input']:
-            inputs[key] = self.command['input'][key]['name']
-        return inputs
+        return dict(self.inputs.items())
 
-    def input(self, opt='?'):
+    def input(self, opt='?', max_age=None):
         """
         Description:
 
@@ -185,26 +767,28 @@ class TV(object):
             Call with no arguments to get current setting
 
         Arguments:
-            opt: string
-                Name provided from input list or key from yaml
-                ("HDMI 1" or "hdmi_1")
+            opt: string or integer
+                Name provided from input list, key from yaml or index
+                ("HDMI 1", "hdmi_1" or 1)
+            max_age: see power()
         """
         if opt == '?':
-            index = self._send_command('input_index')
-            if index is False:
-                # return self.command['input']['tv']['index']
-                return False
-            else:
-                for key in self.command['input']:
-                    if (self.command['input'][key]['index'] == index):
-                        return self.command['input'][key]['index']
-        else:
-            for key in self.command['input']:
-                if (key == opt) or (self.command['input'][key]['index'] == opt):
-                    return self._send_command(['input', key, 'command'])
+            cached = self._cached('input', opt, max_age)
+            if cached is not None:
+                return cached
+            return self._input_from_index(self._send_command('input_index'))
+        key = self.inputs.key(opt)
+        if key is None:
             return False
+        return self._send_command('input.%s.command' % key)
 
-    def av_mode(self, opt='?'):
+    def _input_from_index(self, index):
+        if index is False:
+            # return self.command['input']['tv']['index']
+            return False
+        return self.inputs.index(index)
+
+    def av_mode(self, opt='?', max_age=None):
         """
         Description:
 
@@ -228,10 +812,11 @@ class TV(object):
                 16: Game 3D
                 17: Movie THX
                 100: Auto
+            max_age: see power()
         """
-        return self._send_command('av_mode', opt)
+        return self._send_field('av_mode', opt, max_age)
 
-    def volume(self, opt='?'):
+    def volume(self, opt='?', max_age=None):
         """
         Description:
 
@@ -241,8 +826,9 @@ class TV(object):
         Arguments:
             opt: integer
             0 - 100: Volume Level
+            max_age: see power()
         """
-        return self._send_command('volume', opt)
+        return self._send_field('volume', opt, max_age)
 
     def volume_up(self):
         """
@@ -258,7 +844,7 @@ class TV(object):
         """
         return self._send_command('volume_down')
 
-    def view_mode(self, opt='?'):
+    def view_mode(self, opt='?', max_age=None):
         """
         Description:
 
@@ -279,10 +865,11 @@ class TV(object):
                 9: Full Screen [AV]
                 10: Auto
                 11: Original
+            max_age: see power()
         """
-        return self._send_command('view_mode', opt)
+        return self._send_field('view_mode', opt, max_age)
 
-    def mute(self, opt='?'):
+    def mute(self, opt='?', max_age=None):
         """
         Description:
 
@@ -294,10 +881,11 @@ class TV(object):
                 0: Toggle
                 1: On
                 2: Off
+            max_age: see power()
         """
-        return self._send_command('mute', opt)
+        return self._send_field('mute', opt, max_age)
 
-    def surround(self, opt='?'):
+    def surround(self, opt='?', max_age=None):
         """
         Description:
 
@@ -313,10 +901,11 @@ class TV(object):
                 5: 3D Movie
                 6: 3D Standard
                 7: 3D Stadium
+            max_age: see power()
         """
-        return self._send_command('sound_mode', opt)
+        return self._send_field('surround', opt, max_age)
 
-    def sleep(self, opt='?'):
+    def sleep(self, opt='?', max_age=None):
         """
         Description:
 
@@ -330,10 +919,11 @@ class TV(object):
                 2: 60 minutes
                 3: 90 minutes
                 4: 120 minutes
+            max_age: see power()
         """
-        return self._send_command('sleep', opt)
+        return self._send_field('sleep', opt, max_age)
 
-    def analog_channel(self, opt='?'):
+    def analog_channel(self, opt='?', max_age=None):
         """
         Description:
 
@@ -343,10 +933,11 @@ class TV(object):
         Arguments:
             opt: integer
                 (1-135): Channel
+            max_age: see power()
         """
-        return self._send_command('analog_channel', opt)
+        return self._send_field('analog_channel', opt, max_age)
 
-    def digital_channel_air(self, opt1='?', opt2='?'):
+    def digital_channel_air(self, opt1='?', opt2='?', max_age=None):
         """
         Description:
 
@@ -358,6 +949,7 @@ class TV(object):
                 1-99: Major Channel
             opt2: integer (optional)
                 1-99: Minor Channel
+            max_age: see power()
         """
         if opt1 == '?':
             parameter = '?'
@@ -365,9 +957,9 @@ class TV(object):
             parameter = str(opt1).rjust(4, "0")
         else:
             parameter = '{:02d}{:02d}'.format(opt1, opt2)
-        return self._send_command('digital_channel_air', parameter)
+        return self._send_field('digital_channel_air', parameter, max_age)
 
-    def digital_channel_cable(self, opt1='?', opt2=0):
+    def digital_channel_cable(self, opt1='?', opt2=0, max_age=None):
         """
         Description:
 
@@ -379,6 +971,7 @@ class TV(object):
                 1-999: Major Channel
             opt2: integer (optional)
                 0-999: Minor Channel
+            max_age: see power()
         """
         if opt1 == '?':
             parameter = '?'
@@ -387,7 +980,7 @@ class TV(object):
         else:
             self._send_command('digital_channel_cable_minor', str(opt1).rjust(3, "0"))
             parameter = str(opt2).rjust(3, "0")
-        return self._send_command('digital_channel_cable_major', parameter)
+        return self._send_field('digital_channel_cable', parameter, max_age)
 
     def channel_up(self):
         """
@@ -411,11 +1004,7 @@ class TV(object):
             Returns an list of all available remote buttons
 
         """
-        remote_buttons = []
-        for key in self.command['remote']:
-            if self.command['remote'][key] != '':
-                remote_buttons.append(key)
-        return remote_buttons
+        return self.remote_keys.names()
 
     def remote_button(self, opt):
         """
@@ -424,7 +1013,60 @@ class TV(object):
             Press a remote control button
 
         Arguments:
-            opt: string
-                key provided from input list
+            opt: string or integer
+                name from the remote button list or key number,
+                e.g. "play" or 16
+        """
+        return self.press(opt)
+
+    def press(self, key, repeat=1, interval=0):
+        """
+        Description:
+
+            Press a remote control key one or more times.
+            The presses are written interval seconds apart
+            without waiting for the reply to each of them,
+            the replies are read afterwards.
+
+        Arguments:
+            key: string or integer
+                name or number of the key, see remote_button()
+            repeat: integer
+                number of presses, at least 1
+            interval: seconds between two presses
+
+        Returns:
+            True if the TV acknowledged every press
+        """
+        frame = self._press_frame(key, repeat)
+        return self._all_acknowledged(self._send_frames([frame] * repeat, interval))
+
+    def _press_frame(self, key, repeat):
+        if repeat < 1:
+            raise ValueError("repeat must be at least 1, not %s" % (repeat,))
+        return self.remote_keys.frame(key)
+
+    @staticmethod
+    def _all_acknowledged(results):
+        return all(result is True for result in results)
+
+
+class IpTV(TV):
+    """
+    Description:
+        Sharp Aquos TV controlled over the network
+        with the IP control protocol, see TcpConnection
+
+        The commands and their replies are the same as on RS-232C,
+        one logged in session is reused for all of them.
+    """
+
+    def __init__(self, host, port=IP_PORT, username=None, password=None,
+                 timeout=2, command_map='us', retries=2, login_timeout=2):
+        """
+        Initialize the client.
         """
-        return self._send_command(['remote', opt])
+        self._connection = TcpConnection(
+            host, port, username=username, password=password,
+            timeout=timeout, login_timeout=login_timeout)
+        self._init_client(command_map, retries)
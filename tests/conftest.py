@@ -0,0 +1,59 @@
+"""Fixtures running the clients against the emulated TV of benchmarks/emulator.py."""
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'custom_components'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from emulator import AquosEmulator  # noqa: E402
+
+
+@pytest.fixture
+def emulator():
+    """Yield a factory of started emulators, stopped after the test."""
+    started = []
+
+    def start(**options):
+        emulator = AquosEmulator(**options)
+        started.append(emulator)
+        return emulator
+
+    yield start
+    for emulator in started:
+        emulator.stop()
+
+
+def drop_once(emulator, prefix, count=1):
+    """Leave the first count commands starting with prefix unanswered."""
+    handle = emulator.handle
+    left = [count]
+
+    def dropping(frame):
+        if frame.startswith(prefix) and left[0]:
+            left[0] -= 1
+            emulator.received.append(frame.decode('ascii'))
+            return None
+        return handle(frame)
+    emulator.handle = dropping
+
+
+def delay_once(emulator, prefix, delay):
+    """Answer the first command starting with prefix delay seconds late."""
+    handle = emulator.handle
+    left = [1]
+
+    def delaying(frame):
+        if frame.startswith(prefix) and left[0]:
+            left[0] -= 1
+            time.sleep(delay)
+        return handle(frame)
+    emulator.handle = delaying
+
+
+def sent(emulator, prefix):
+    """Return how many commands starting with prefix the emulator received."""
+    return sum(1 for command in emulator.received if command.startswith(prefix))
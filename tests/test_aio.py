@@ -0,0 +1,125 @@
+"""AsyncTV and AsyncIpTV against the emulated TV."""
+import asyncio
+
+import pytest
+
+from aquostv_serial.aio import AsyncIpTV, AsyncTV
+from aquostv_serial.connection import LoginError
+from conftest import delay_once, drop_once, sent
+
+FIELDS = ('power', 'mute', 'input', 'volume')
+EXPECTED = (1, 2, 1, 20)
+
+
+def values(status):
+    return tuple(getattr(status, field) for field in FIELDS)
+
+
+def run(device, test, client=AsyncTV, tcp=None, **options):
+    """Run test(client) on a new event loop, connected to device."""
+    async def main():
+        if tcp is None:
+            tv = client(device.start(), **options)
+        else:
+            tv = client(*device.start_tcp(**tcp), **options)
+        try:
+            return await test(tv)
+        finally:
+            await tv.close()
+    return asyncio.run(main())
+
+
+def test_status_is_pipelined(emulator):
+    device = emulator(reply_delay=0.01)
+
+    async def test(tv):
+        assert values(await tv.status(FIELDS)) == EXPECTED
+    run(device, test, timeout=0.3)
+    assert device.received == ['POWR?   ', 'MUTE?   ', 'IAVD?   ', 'VOLM?   ']
+
+
+def test_status_recovers_from_dropped_reply(emulator):
+    device = emulator()
+    drop_once(device, b'VOLM')
+
+    async def test(tv):
+        assert values(await tv.status(FIELDS)) == EXPECTED
+        assert values(await tv.status(FIELDS)) == EXPECTED
+    run(device, test, timeout=0.3)
+
+
+@pytest.mark.parametrize('prefix', [b'POWR', b'MUTE', b'IAVD', b'VOLM'])
+@pytest.mark.parametrize('tcp', [None, {}], ids=['serial', 'tcp'])
+def test_late_reply_does_not_shift_later_replies(emulator, prefix, tcp):
+    device = emulator(reply_delay=0.12)
+    delay_once(device, prefix, 0.3)
+
+    async def test(tv):
+        assert values(await tv.status(FIELDS)) == EXPECTED
+        assert values(await tv.status(FIELDS)) == EXPECTED
+    run(device, test, client=AsyncTV if tcp is None else AsyncIpTV, tcp=tcp, timeout=0.25)
+
+
+def test_press_repeat_is_not_resent(emulator):
+    device = emulator()
+    drop_once(device, b'RCKY')
+
+    async def test(tv):
+        with pytest.raises(OSError):
+            await tv.press('play', repeat=5)
+    run(device, test, timeout=0.3)
+    assert sent(device, 'RCKY') == 5
+
+
+def test_run_scene_keeps_partial_results(emulator):
+    device = emulator()
+    drop_once(device, b'MUTE', count=10)
+
+    async def test(tv):
+        return await tv.run_scene([('volume', 5), {'delay': 0.01},
+                                   ('mute', 1), {'delay': 0.01}, ('volume', 7)])
+    results = run(device, test, timeout=0.3, retries=0)
+    assert results[:2] == [True, None]
+    assert isinstance(results[2], OSError)
+    assert results[3:] == [None, None]
+    assert device.volume == 5
+
+
+def test_power_on_waits_until_booted(emulator):
+    device = emulator(boot_time=0.6)
+    device.power = 0
+
+    async def test(tv):
+        tv.warm_up.probe_interval = 0.1
+        assert await tv.power(1) is True
+        assert tv.warm_up.active
+        assert await tv.volume() == 20
+        assert not tv.warm_up.active
+    run(device, test, timeout=0.3)
+    assert sent(device, 'POWR?') >= 2
+
+
+def test_ip_tv_logs_in_again_after_session_closed(emulator):
+    device = emulator()
+
+    async def test(tv):
+        assert await tv.power() == 1
+        device.close_sessions()
+        return await tv.volume()
+    volume = run(device, test, client=AsyncIpTV,
+                 tcp={'username': 'admin', 'password': 'secret'},
+                 username='admin', password='secret', timeout=0.3)
+    assert volume == 20
+    assert device.logins == 2
+
+
+def test_ip_tv_reports_rejected_login(emulator):
+    device = emulator()
+
+    async def test(tv):
+        with pytest.raises(LoginError):
+            await tv.open()
+        assert tv.reopen_backoff.wait() > 0
+    run(device, test, client=AsyncIpTV, tcp={'username': 'admin', 'password': 'secret'},
+        username='admin', password='wrong', timeout=0.3)
+    assert device.logins == 0
@@ -0,0 +1,64 @@
+"""Input and remote key lookups of the shipped command maps."""
+import pytest
+
+from aquostv_serial.commands import VALID_COMMAND_MAPS, get_command_map
+
+
+@pytest.fixture(params=VALID_COMMAND_MAPS)
+def command_map(request):
+    return get_command_map(request.param)
+
+
+def test_inputs_resolve_by_key_name_and_index(command_map):
+    inputs = command_map.inputs
+    for key, name in inputs.items():
+        index = inputs.index(key)
+        assert inputs.key(name) == key
+        assert inputs.name(key) == name
+        assert inputs.key(index) in inputs
+        assert inputs.index(inputs.key(index)) == index
+    assert inputs.key('tv') == inputs.key(0) == 'tv'
+    assert inputs.key('HDMI 1') == 'hdmi_1'
+
+
+def test_inputs_reject_unknown_and_error_replies(command_map):
+    inputs = command_map.inputs
+    assert inputs.key(False) is None
+    assert inputs.key(99) is None
+    assert inputs.name('no_such_input') is None
+    assert 'no_such_input' not in inputs
+
+
+def test_remote_number_keys_resolve_by_name(command_map):
+    remote = command_map.remote
+    for digit in range(10):
+        assert remote.name(digit) is not None
+        assert remote.name(str(digit)) == str(digit)
+        assert remote.frame(digit) == remote.frame(str(digit))
+    assert remote.name(1) == '1'
+
+
+def test_remote_frames_are_padded(command_map):
+    for name in command_map.remote:
+        frame = command_map.remote.frame(name)
+        assert len(frame) == 10
+        assert frame.endswith(b'\r\n')
+
+
+def test_remote_codes_only_for_rcky_keys(command_map):
+    remote = command_map.remote
+    for name, command in command_map.command['remote'].items():
+        if command.startswith('RCKY'):
+            assert remote.name(int(command[4:])) is not None
+    if remote.frame('play').startswith(b'RCKY'):
+        assert remote.name(16) == 'play'
+    else:
+        assert remote.name(16) is None
+
+
+def test_remote_rejects_unknown_keys(command_map):
+    remote = command_map.remote
+    assert remote.name(True) is None
+    assert 'no_such_key' not in remote
+    with pytest.raises(ValueError):
+        remote.frame('no_such_key')
@@ -0,0 +1,24 @@
+"""Capabilities learned per model by DeviceCache."""
+from aquostv_serial.devices import DeviceCache
+
+INFO = {'name': 'TV', 'model': 'LC-60LE650U', 'version': '1.00', 'ip_version': '1'}
+
+
+def cache_with_unsupported(*models):
+    return DeviceCache({'devices': {'/dev/ttyUSB0': dict(INFO)},
+                        'unsupported': {model: ['sleep'] for model in models}})
+
+
+def test_new_firmware_of_same_model_is_learned_again():
+    cache = cache_with_unsupported(INFO['model'])
+    record = cache.device('/dev/ttyUSB0')
+    assert record.update_info(dict(INFO, version='2.00'))
+    assert record.unsupported == frozenset()
+
+
+def test_other_model_keeps_what_was_learned():
+    cache = cache_with_unsupported(INFO['model'], 'LC-70UD27U')
+    record = cache.device('/dev/ttyUSB0')
+    assert record.update_info(dict(INFO, model='LC-70UD27U', version='2.00'))
+    assert record.unsupported == frozenset({'sleep'})
+    assert cache.as_dict()['unsupported'][INFO['model']] == ['sleep']
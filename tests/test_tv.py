@@ -0,0 +1,141 @@
+"""TV and IpTV against the emulated TV."""
+import pytest
+
+from aquostv_serial.connection import LoginError
+from aquostv_serial.tv import TV, IpTV
+from conftest import delay_once, drop_once, sent
+
+FIELDS = ('power', 'mute', 'input', 'volume')
+EXPECTED = (1, 2, 1, 20)
+
+
+def values(status):
+    return tuple(getattr(status, field) for field in FIELDS)
+
+
+@pytest.fixture
+def tv(emulator):
+    clients = []
+
+    def connect(client=TV, **options):
+        emulator_options = options.pop('emulator', {})
+        tcp = options.pop('tcp', None)
+        device = emulator(**emulator_options)
+        if tcp is None:
+            client = client(device.start(), **options)
+        else:
+            client = client(*device.start_tcp(**tcp), **options)
+        clients.append(client)
+        return client, device
+
+    yield connect
+    for client in clients:
+        client._connection.close()
+
+
+def test_status_is_pipelined(tv):
+    client, device = tv(emulator={'reply_delay': 0.01}, timeout=0.3)
+    assert values(client.status(FIELDS)) == EXPECTED
+    assert device.received == ['POWR?   ', 'MUTE?   ', 'IAVD?   ', 'VOLM?   ']
+    assert client.state.get('volume') == 20
+
+
+def test_status_recovers_from_dropped_reply(tv):
+    client, device = tv(timeout=0.3)
+    drop_once(device, b'VOLM')
+    assert values(client.status(FIELDS)) == EXPECTED
+    assert values(client.status(FIELDS)) == EXPECTED
+    assert sent(device, 'VOLM?') == 3
+
+
+@pytest.mark.parametrize('prefix', [b'POWR', b'MUTE', b'IAVD', b'VOLM'])
+@pytest.mark.parametrize('tcp', [None, {}], ids=['serial', 'tcp'])
+def test_late_reply_does_not_shift_later_replies(tv, prefix, tcp):
+    client, device = tv(client=TV if tcp is None else IpTV, tcp=tcp,
+                        emulator={'reply_delay': 0.12}, timeout=0.25)
+    delay_once(device, prefix, 0.3)
+    assert values(client.status(FIELDS)) == EXPECTED
+    assert values(client.status(FIELDS)) == EXPECTED
+
+
+def test_press_repeat_is_not_resent(tv):
+    client, device = tv(timeout=0.3)
+    drop_once(device, b'RCKY')
+    with pytest.raises(OSError):
+        client.press('play', repeat=5)
+    assert sent(device, 'RCKY') == 5
+    assert client.press(33, repeat=3)
+    assert sent(device, 'RCKY0033') == 3
+
+
+def test_press_needs_one_repeat(tv):
+    client, device = tv(timeout=0.3)
+    with pytest.raises(ValueError):
+        client.press('play', repeat=0)
+    assert device.received == []
+
+
+def test_run_scene_keeps_partial_results(tv):
+    client, device = tv(timeout=0.3, retries=0)
+    drop_once(device, b'MUTE', count=10)
+    results = client.run_scene([('volume', 5), {'delay': 0.01},
+                                ('mute', 1), {'delay': 0.01}, ('volume', 7)])
+    assert results[0] is True
+    assert results[1] is None
+    assert isinstance(results[2], OSError)
+    assert results[3:] == [None, None]
+    assert device.volume == 5
+    assert sent(device, 'VOLM07') == 0
+
+
+def test_power_on_waits_until_booted(tv):
+    client, device = tv(emulator={'boot_time': 0.6}, timeout=0.3)
+    client.warm_up.probe_interval = 0.1
+    device.power = 0
+    assert client.power(1) is True
+    assert client.warming_up
+    assert client.volume() == 20
+    assert not client.warming_up
+    assert sent(device, 'POWR?') >= 2
+
+
+def test_ip_tv_logs_in_again_after_session_closed(tv):
+    client, device = tv(client=IpTV, tcp={'username': 'admin', 'password': 'secret'},
+                        username='admin', password='secret', timeout=0.3)
+    assert client.power() == 1
+    device.close_sessions()
+    assert client.volume() == 20
+    assert device.logins == 2
+
+
+def test_ip_tv_reports_rejected_login(emulator):
+    device = emulator()
+    host, port = device.start_tcp(username='admin', password='secret')
+    with pytest.raises(LoginError):
+        IpTV(host, port, username='admin', password='wrong', timeout=0.3)
+    assert device.logins == 0
+
+
+def test_channel_is_forgotten_after_channel_change(tv):
+    client, device = tv(timeout=0.3)
+    assert client.input('tv') is True
+    status = client.status(('input', 'analog_channel', 'digital_channel_air'))
+    assert (status.input, status.analog_channel, status.digital_channel_air) == (0, 1, 101)
+    client.channel_up()
+    assert client.state.get('analog_channel') is None
+    assert client.analog_channel(max_age=60) == 1
+
+
+@pytest.mark.parametrize('tcp', [None, {}], ids=['serial', 'tcp'])
+def test_write_once_setting_is_sent_again_after_reopen(tv, tcp):
+    client, device = tv(client=TV if tcp is None else IpTV, tcp=tcp, timeout=0.3)
+    assert client.power_on_command_settings(2) is True
+    assert client.power_on_command_settings(2) is True
+    assert sent(device, 'RSPW2') == 1
+    if tcp is None:
+        client._connection.close()
+    else:
+        device.close_sessions()
+        assert client.volume() == 20
+    assert client.power_on_command_settings(2) is True
+    assert sent(device, 'RSPW2') == 2